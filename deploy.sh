@@ -10,6 +10,14 @@ echo "# Bot does his stuff" >> mycron
 echo "0 0 * * * cd /home/pi/bot/src/ && python main.py" >> mycron
 echo "0 8 * * * cd /home/pi/bot/src/ && python main.py" >> mycron
 echo "0 16 * * * cd /home/pi/bot/src/ && python main.py" >> mycron
+echo "@reboot cd /home/pi/bot/src/ && python status.py --port 8765" >> mycron
+echo "30 4 * * * cd /home/pi/bot/src/ && nice -n 19 ionice -c 3 python backup.py" >> mycron
+echo "0 1 * * * cd /home/pi/bot/src/ && nice -n 19 timeout 6.5h python optimize.py" >> mycron
+echo "30 5 * * * cd /home/pi/bot/src/ && nice -n 19 python montecarlo.py" >> mycron
+# Pre-close mode: uncomment to trade right at candle close, the regular runs then only report
+# echo "55 23 * * * cd /home/pi/bot/src/ && python main.py --preclose" >> mycron
+# echo "55 7 * * * cd /home/pi/bot/src/ && python main.py --preclose" >> mycron
+# echo "55 15 * * * cd /home/pi/bot/src/ && python main.py --preclose" >> mycron
 
 crontab mycron
 rm mycron
@@ -0,0 +1,145 @@
+###########################################################################################################################################
+# PORTFOLIO BACKTEST
+###########################################################################################################################################
+
+import numpy as np
+import pandas as pd
+
+import indicators as ind
+from utils import get_master_data, get_pair_data
+
+
+def load_close_panel(db, pair_list, start_date=None):
+    """
+    Info:   Load close prices of several pairs into one timestamp x pair panel
+    Path:   NA
+    Input:  db         - string    = database name
+            pair_list  - list      = pairs to be loaded
+            start_date - string    = only load candles after this date (YYYY-MM-DD)
+    Output: dataframe              = close prices indexed by timestamp, one column per pair
+    """
+
+    series = {}
+    for pair in pair_list:
+        df = get_pair_data(pair, db, start_date=start_date)
+        series[pair] = df.set_index('timestamp')['close']
+
+    return pd.DataFrame(series).sort_index()
+
+
+def backtest_portfolio(db, master_tbl, start_date=None, budget=100, fee=0.002):
+    """
+    Info:   Replay every master_tbl strategy over stored candles with the live gen_txn allocation
+    Path:   NA
+    Input:  db         - string = database name
+            master_tbl - string = master table name
+            start_date - string = date to start the replay (YYYY-MM-DD), full history if None
+            budget     - float  = starting USDT balance
+            fee        - float  = commission rate paid on every order
+    Output: A list              = [final equity (float);
+                                   (dataframe) equity curve with cash, position, equity, turnover;
+                                   (dataframe) of trades with timestamp, pair, strategy, action, price, quote_qty]
+    Note:   Signals follow utils.simulate (EMA cross up/down and cut loss on the buy price).
+            At every timestamp sells are executed first, then each BUY gets
+            USDT / (count_signal - len(hold_list) + len(sell_list)) like gen_txn.
+            EMAs are computed over the whole replayed history instead of the ema*3 days window.
+    """
+
+    df_master = get_master_data(db, master_tbl)
+    panel = load_close_panel(db, df_master['pair'].unique().tolist(), start_date)
+
+    col = panel.columns.get_indexer(df_master['pair'])
+    close = panel.to_numpy(dtype='float64')[:, col]
+    cut_loss = df_master['cut_loss'].to_numpy(dtype='float64')
+    strategy = (df_master['ema'].astype(str) +
+                df_master['cut_loss'].astype(str)).to_numpy()
+
+    # EMA once per distinct span over the panel, shared with other runs through the indicator cache
+    ema = np.empty_like(close)
+    first_ts, last_ts = (panel.index[0], panel.index[-1]) if len(panel) else (None, None)
+    for span, rows in df_master.groupby('ema').indices.items():
+        pairs = df_master['pair'].iloc[rows].unique().tolist()
+        values = ind.cache.compute(','.join(pairs), 'ema', (int(span), ), first_ts,
+                                   last_ts, ind.ema,
+                                   panel[pairs].to_numpy(dtype='float64'))
+        ema[:, rows] = values[:, [pairs.index(p) for p in df_master['pair'].iloc[rows]]]
+
+    n_time, n_strat = close.shape
+    cash = float(budget)
+    held = np.zeros(n_strat, dtype=bool)
+    tokens = np.zeros(n_strat)
+    b_price = np.zeros(n_strat)
+    l_price = np.full(n_strat, np.nan)
+    l_ema = np.full(n_strat, np.nan)
+    mark = np.zeros(n_strat)
+
+    curve = np.empty((n_time, 4))
+    trades = []
+
+    with np.errstate(invalid='ignore'):
+        for t in range(n_time):
+            price = close[t]
+            valid = ~np.isnan(price)
+            turnover = 0.0
+
+            cross_up = valid & (price > ema[t]) & (l_price < l_ema)
+            cross_down = valid & (price < ema[t]) & (l_price > l_ema)
+            cut = valid & held & (price < b_price * (1 - cut_loss))
+            sell = held & (cut | cross_down)
+            buy = cross_up & ~held
+
+            # Sells free USDT first
+            n_hold = held.sum()
+            n_sell = sell.sum()
+            if n_sell:
+                gross = tokens[sell] * price[sell]
+                cash += (gross * (1 - fee)).sum()
+                turnover += gross.sum()
+                trades.append((np.full(n_sell, t), np.flatnonzero(sell),
+                               np.where(cut[sell], 'CUT_SELL', 'SELL'),
+                               price[sell], gross * (1 - fee)))
+                tokens[sell] = 0
+                held[sell] = False
+
+            # Buys share the free USDT among the strategies without position
+            n_buy = buy.sum()
+            slots = n_strat - n_hold + n_sell
+            if n_buy and slots > 0:
+                txn_amt = round(cash / slots, 3)
+                tokens[buy] = txn_amt * (1 - fee) / price[buy]
+                b_price[buy] = price[buy]
+                held[buy] = True
+                cash -= txn_amt * n_buy
+                turnover += txn_amt * n_buy
+                trades.append((np.full(n_buy, t), np.flatnonzero(buy),
+                               np.full(n_buy, 'BUY'), price[buy],
+                               np.full(n_buy, txn_amt)))
+
+            l_price = np.where(valid, price, l_price)
+            l_ema = np.where(valid, ema[t], l_ema)
+            mark = np.where(valid, price, mark)
+
+            position = (tokens * mark).sum()
+            curve[t] = [cash, position, cash + position, turnover]
+
+    curve = pd.DataFrame(curve,
+                         index=panel.index,
+                         columns=['cash', 'position', 'equity', 'turnover'])
+    curve.index.name = 'timestamp'
+    curve = curve.reset_index()
+
+    t_idx, s_idx, action, price, quote_qty = [
+        np.concatenate(c) for c in zip(*trades)
+    ] if trades else [np.array([], dtype=int)] * 2 + [np.array([])] * 3
+    trades = pd.DataFrame({
+        'timestamp': panel.index[t_idx],
+        'pair': df_master['pair'].to_numpy()[s_idx],
+        'strategy': strategy[s_idx],
+        'action': action,
+        'price': price,
+        'quote_qty': quote_qty
+    })
+
+    result = curve['equity'].iat[-1] if len(curve) != 0 else float(budget)
+
+    return [result, curve, trades]
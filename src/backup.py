@@ -0,0 +1,214 @@
+###########################################################################################################################################
+# DATABASE BACKUP
+###########################################################################################################################################
+
+import argparse
+import configparser
+import datetime as dt
+import glob
+import gzip
+import os
+import shutil
+import sqlite3 as lite
+import tempfile
+import time
+
+
+def snapshot_name(db, when=None):
+    """
+    Info:   Get the file name of a snapshot
+    Path:   NA
+    Input:  db   - string   = database name
+            when - datetime = snapshot time (UTC), now if None
+    Output: string          = <db name>_<YYYYmmddHHMMSS>.db
+    """
+
+    name = os.path.splitext(os.path.basename(db))[0]
+    return '{0}_{1:%Y%m%d%H%M%S}.db'.format(name, when or dt.datetime.utcnow())
+
+
+def is_quiet(interval_hours=8, margin_minutes=20, now=None):
+    """
+    Info:   Check if now is far enough from a candle close (trading window) to run a backup
+    Path:   NA
+    Input:  interval_hours - int      = candle interval, sessions start at multiples of it (UTC)
+            margin_minutes - int      = minutes kept free before and after each close
+            now            - datetime = time to check (UTC), now if None
+    Output: bool
+    """
+
+    now = now or dt.datetime.utcnow()
+    minutes = (now.hour % interval_hours) * 60 + now.minute
+    return margin_minutes <= minutes <= interval_hours * 60 - margin_minutes
+
+
+def backup(db, dest_dir='backups', pages=256, sleep=0.05, keep=7, compress=True):
+    """
+    Info:   Online backup of the database while it stays usable by the bot
+    Path:   dest_dir
+    Input:  db       - string = database name
+            dest_dir - string = directory of the snapshots
+            pages    - int    = pages copied per step
+            sleep    - float  = seconds between steps, writers get the lock in between
+            keep     - int    = snapshots kept, older ones are removed
+            compress - bool   = gzip the snapshot
+    Output: string            = snapshot path
+    Note:   Uses the SQLite online backup API. A step only holds a read lock, and a write
+            by another connection between steps restarts the copy so the snapshot is consistent.
+    """
+
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, snapshot_name(db))
+    tmp = path + '.tmp'
+
+    src = lite.connect(db)
+    dst = lite.connect(tmp)
+    try:
+        with dst:
+            src.backup(dst, pages=pages, sleep=sleep)
+    finally:
+        dst.close()
+        src.close()
+
+    if compress:
+        with open(tmp, 'rb') as f_in, gzip.open(path + '.gz.tmp', 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        os.remove(tmp)
+        tmp, path = path + '.gz.tmp', path + '.gz'
+    os.replace(tmp, path)
+
+    rotate(db, dest_dir, keep)
+
+    return path
+
+
+def rotate(db, dest_dir='backups', keep=7):
+    """
+    Info:   Remove the oldest snapshots of a database
+    Path:   dest_dir
+    Input:  db       - string = database name
+            dest_dir - string = directory of the snapshots
+            keep     - int    = snapshots kept
+    Output: list              = removed snapshot paths
+    """
+
+    name = os.path.splitext(os.path.basename(db))[0]
+    snapshots = sorted(
+        glob.glob(os.path.join(dest_dir, name + '_*.db')) +
+        glob.glob(os.path.join(dest_dir, name + '_*.db.gz')))
+    removed = snapshots[:max(len(snapshots) - keep, 0)]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def open_snapshot(path, target=None):
+    """
+    Info:   Get a plain SQLite file of a snapshot, decompressed if needed
+    Path:   NA
+    Input:  path   - string = snapshot path (.db or .db.gz)
+            target - string = file to write to, a temporary file if None
+    Output: string          = SQLite file path
+    """
+
+    if not path.endswith('.gz'):
+        if target is None:
+            return path
+        shutil.copyfile(path, target)
+        return target
+
+    if target is None:
+        fd, target = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+    with gzip.open(path, 'rb') as f_in, open(target, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    return target
+
+
+def verify(path):
+    """
+    Info:   Check that a snapshot restores to a valid database
+    Path:   NA
+    Input:  path - string = snapshot path
+    Output: dict          = ok (bool), integrity check result, row count per table
+    """
+
+    plain = open_snapshot(path)
+    try:
+        con = lite.connect(plain)
+        integrity = con.execute('pragma integrity_check').fetchone()[0]
+        tables = [r[0] for r in con.execute(
+            "select name from sqlite_master where type='table' order by name")]
+        counts = {t: con.execute('select count(*) from "{0}"'.format(t)).fetchone()[0]
+                  for t in tables}
+        con.close()
+    finally:
+        if plain != path:
+            os.remove(plain)
+
+    return {'ok': integrity == 'ok', 'integrity': integrity, 'tables': counts}
+
+
+def restore(path, db, force=False):
+    """
+    Info:   Restore a verified snapshot to a database file
+    Path:   NA
+    Input:  path  - string = snapshot path
+            db    - string = database file to write
+            force - bool   = overwrite an existing database
+    Output: dict           = verify() result of the snapshot
+    """
+
+    if os.path.exists(db) and not force:
+        raise FileExistsError('{0} exists, use force to overwrite'.format(db))
+
+    result = verify(path)
+    if not result['ok']:
+        raise ValueError('{0} failed the integrity check: {1}'.format(path, result['integrity']))
+
+    open_snapshot(path, db + '.restore')
+    os.replace(db + '.restore', db)
+
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='config.ini', help='configuration file')
+    parser.add_argument('--db', help='database to back up, [db] db_name if not given')
+    parser.add_argument('--verify', metavar='SNAPSHOT', help='check a snapshot and exit')
+    parser.add_argument('--restore', metavar='SNAPSHOT', help='restore a snapshot to --db')
+    parser.add_argument('--force', action='store_true',
+                        help='back up inside a trading window / overwrite on restore')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    db = args.db or config.get('db', 'db_name')
+
+    if args.verify:
+        result = verify(args.verify)
+        for table, rows in result['tables'].items():
+            print('{0:<30} {1:>10}'.format(table, rows))
+        print('integrity: {0}'.format(result['integrity']))
+        raise SystemExit(0 if result['ok'] else 1)
+
+    if args.restore:
+        restore(args.restore, db, args.force)
+        print('restored {0} to {1}'.format(args.restore, db))
+        raise SystemExit(0)
+
+    if not args.force and not is_quiet(margin_minutes=config.getint('backup', 'margin', fallback=20)):
+        print('trading window, backup skipped')
+        raise SystemExit(0)
+
+    start = time.time()
+    path = backup(db,
+                  config.get('backup', 'dir', fallback='backups'),
+                  pages=config.getint('backup', 'pages', fallback=256),
+                  sleep=config.getfloat('backup', 'sleep', fallback=0.05),
+                  keep=config.getint('backup', 'keep', fallback=7),
+                  compress=config.getboolean('backup', 'compress', fallback=True))
+    result = verify(path)
+    print('{0} in {1:.1f}s, integrity: {2}'.format(path, time.time() - start, result['integrity']))
+    raise SystemExit(0 if result['ok'] else 1)
@@ -8,21 +8,57 @@ import asyncio
 
 import datetime as dt
 from utils import *
+from clock import ServerClock
+from writer import KlineWriter
 import time
 
 
 class Binance:
 
-    def __init__(self, api_key, api_secret):
+    client_cls = Client
+    async_client_cls = AsyncClient
+
+    def __init__(self, api_key, api_secret, clock_interval=60, min_notional=10.0):
         self.api_key = api_key
         self.api_secret = api_secret
-        self.client = Client(api_key=api_key, api_secret=api_secret)
+        self.min_notional = min_notional
+        # Exchange clock time the session signals were ready, set by the caller for the ledger
+        self.signal_ms = None
+        self.client = self.client_cls(api_key=api_key, api_secret=api_secret)
+
+        # Keep request timestamps aligned with the exchange clock in the background
+        self.clock = ServerClock(
+            server_time=lambda: self.client.get_server_time()['serverTime'],
+            interval=clock_interval)
+        self.clock.attach(self.client)
+        self.clock.start()
 
     def get_data(self,
                 db,
                 pair_list,
                 interval='8h',
                 start_date=None):
+        """
+        Info:   Fetch the klines of every pair concurrently
+        Path:   NA
+        Input:  db         - string   = database name
+                pair_list  - list     = pairs to be fetched
+                interval   - string   = kline interval
+                start_date - datetime = first candle, from the watermark if None
+        Output: Counter               = new candles written per pair
+        Note:   Coroutines only do network work. Tables and watermarks are prepared before
+                the event loop starts and pages are handed to a KlineWriter thread, so disk
+                writes overlap the requests still in flight.
+        """
+
+        # Legacy tables are migrated before their watermarks are read
+        con = lite.connect(db)
+        for pair in pair_list:
+            ini_kline_tbl(con, pair)
+        con.close()
+        last = {pair: get_watermark(db, pair, interval) for pair in pair_list}
+
+        writer = KlineWriter(db, interval)
 
         async def get_bnc_data(db, pair, start_date, interval, api_key, api_secret):
             """
@@ -55,53 +91,40 @@ class Binance:
             """
 
             end_date = dt.datetime.utcnow()
+            last_ts = last[pair]
 
             if start_date is None:
-                if interval == '8h':
-                    latest_date = get_date(db, pair, '')
-
-                    if latest_date is not False:
-                        start_date = latest_date + dt.timedelta(hours=8 - 7)
-                    else:
-                        start_date = dt.datetime.strptime(
-                            '2017-01-01', '%Y-%m-%d')
+                if last_ts is not False and interval in interval_ms:
+                    start_date = dt.datetime.utcfromtimestamp(
+                        (last_ts + interval_ms[interval]) / 1000)
                 else:
                     start_date = dt.datetime.strptime(
                         '2017-01-01', '%Y-%m-%d')
 
             if start_date < end_date:
-                con = lite.connect(db)
-                client = await AsyncClient.create(api_key, api_secret)
+                client = await self.async_client_cls.create(api_key, api_secret)
                 try:
-                    klines = await client.get_historical_klines(
-                        pair, interval, start_date.strftime("%d %b %Y %H:%M:%S"),
-                        end_date.strftime("%d %b %Y %H:%M:%S"), 1000)
+                    # Pages of 1000 decoded one after the other into one array
+                    buffer = KlineBuffer()
+                    page_start = int(start_date.replace(tzinfo=dt.timezone.utc).timestamp() * 1000)
+                    end_ms = int(end_date.replace(tzinfo=dt.timezone.utc).timestamp() * 1000)
+                    while page_start <= end_ms:
+                        page = buffer.extend(await client.get_klines(
+                            symbol=pair, interval=interval, startTime=page_start,
+                            endTime=end_ms, limit=1000))
+                        if len(page) < 1000:
+                            break
+                        page_start = int(page['close_time'][-1]) + 1
                     await client.close_connection()
-                    data = pd.DataFrame(klines,
-                                        columns={
-                                            'timestamp': 'datetime',
-                                            'open': 'float',
-                                            'high': 'float',
-                                            'low': 'float',
-                                            'close': 'float',
-                                            'volume': 'float',
-                                            'close_time': 'datetime',
-                                            'quote_av': 'float',
-                                            'trades': 'int',
-                                            'tb_base_av': 'float',
-                                            'tb_quote_av': 'float',
-                                            'ignore': 'int'
-                                        })
-                    data['timestamp'] = pd.to_datetime(
-                        data['timestamp'], unit='ms') + dt.timedelta(hours=7)
-
-                    data = data.iloc[:-1].copy()
-
-                    data.set_index('timestamp', inplace=True)
-                    data.to_sql(pair, con, if_exists='append')
-                    con.close()
-                except:
+
+                    # Only closed candles are stored
+                    data = buffer.rows[buffer.rows['close_time'] < self.clock.now_ms()]
+
+                    # Waits in a worker thread while the writer queue is full
+                    await asyncio.get_running_loop().run_in_executor(None, writer.put, pair, data)
+                except Exception as e:
                     await client.close_connection()
+                    log('log_master_code.log', f'{pair} {e}', pair=pair, stage='get_data')
 
         loop = asyncio.get_event_loop()
 
@@ -126,7 +149,12 @@ class Binance:
                     retry += 1
                     continue
 
-        loop.run_until_complete(request(loop))
+        try:
+            loop.run_until_complete(request(loop))
+        finally:
+            written = writer.close()
+
+        return written
 
 
     def get_asset(self, asset):
@@ -167,9 +195,12 @@ class Binance:
                 amt         - float  = the amount of asset we will use for the transaction
                 api_key     - string = api key
                 api_secret  - string = api secret
-        Output: order       - dict   = order response information
+        Output: order       - dict   = order response information, with the exchange clock time
+                                       it was sent (submitTime) and answered (ackTime)
         """
 
+        submit_ms = self.clock.now_ms()
+
         # Send the order
         if side == 'BUY':
             order = self.client.create_order(symbol=pair,
@@ -184,6 +215,9 @@ class Binance:
                                         quantity=amt,
                                         newOrderRespType='FULL')
 
+        order['submitTime'] = submit_ms
+        order['ackTime'] = self.clock.now_ms()
+
         return order
 
 
@@ -217,62 +251,139 @@ class Binance:
                 KLINE_INTERVAL_1MONTH   = '1M'
         """
 
-        try:
-            start_date = dt.datetime.strptime(start_date, '%Y%m%d')
-        except:
-            start_date = dt.datetime.strptime('20160101', '%Y%m%d')
-        end_date = dt.datetime.utcnow()
-
         flag = False
         while not flag:
             try:
-                con = lite.connect(db)
-
-                latest_date = get_date(db, pair, '')
-
-                if latest_date is not False:
-                    start_date = latest_date + dt.timedelta(hours=8 - 7)
-
-                if start_date < end_date:
-                    log('log_master_code.log', 'Working on {0}...'.format(pair))
-
-                    klines = self.client.get_historical_klines(
-                        pair, interval, start_date.strftime("%d %b %Y %H:%M:%S"),
-                        end_date.strftime("%d %b %Y %H:%M:%S"), 1000)
-                    data = pd.DataFrame(klines,
-                                        columns={
-                                            'timestamp': 'datetime',
-                                            'open': 'float',
-                                            'high': 'float',
-                                            'low': 'float',
-                                            'close': 'float',
-                                            'volume': 'float',
-                                            'close_time': 'int',
-                                            'quote_av': 'float',
-                                            'trades': 'int',
-                                            'tb_base_av': 'float',
-                                            'tb_quote_av': 'float',
-                                            'ignore': 'int'
-                                        })
-                    data['timestamp'] = pd.to_datetime(
-                        data['timestamp'], unit='ms') + dt.timedelta(hours=7)
-
-                    log('test_date.log', f"{pair} - {data.iloc[-1]}")
-                    data = data.loc[data.timestamp != get_latest_txn_time(
-                        is_lag=False)].copy()
-
-                    data.set_index('timestamp', inplace=True)
-                    data.to_sql(pair, con, if_exists='append')
-                    con.close()
-                    log('log_master_code.log', 'Finished!')
-
+                self.fetch_bnc_data(db, pair, start_date, interval)
                 flag = True
             except Exception as e:
-                log('log_master_code.log', str(pair) + ' ' + str(e))
+                log('log_master_code.log', str(pair) + ' ' + str(e),
+                    pair=pair, stage='get_data')
                 print(e)
                 time.sleep(5)
 
 
+    def fetch_bnc_data(self, db, pair, start_date, interval):
+        """
+        Info:   One attempt of get_bnc_data, errors are raised to the caller
+        Path:   NA
+        Input:  db         - string = database name
+                pair       - string = pair name
+                start_date - string = date to start getting data (YYYYMMDD)
+                interval   - string = kline interval
+        Output: int                 = closed candles written
+        """
+
+        try:
+            start_date = dt.datetime.strptime(start_date, '%Y%m%d')
+        except:
+            start_date = dt.datetime.strptime('20160101', '%Y%m%d')
+        end_date = dt.datetime.utcnow()
+
+        con = lite.connect(db)
+        try:
+            ini_kline_tbl(con, pair)
+
+            last_ts = get_watermark(db, pair, interval)
+
+            if last_ts is not False:
+                start_date = dt.datetime.utcfromtimestamp(
+                    (last_ts + interval_ms[interval]) / 1000)
+
+            if start_date >= end_date:
+                return 0
+
+            log('log_master_code.log', 'Working on {0}...'.format(pair),
+                pair=pair, stage='get_data')
+
+            klines = self.client.get_historical_klines(
+                pair, interval, start_date.strftime("%d %b %Y %H:%M:%S"),
+                end_date.strftime("%d %b %Y %H:%M:%S"), 1000)
+            data = kline_frame(klines)
+            if len(data) == 0:
+                return 0
+
+            log('test_date.log', f"{pair} - {data.iloc[-1]}")
+            # Only closed candles are stored
+            data = data.loc[data.close_time < self.clock.now_ms()]
+
+            write_klines(con, db, pair, data, interval)
+            log('log_master_code.log', 'Finished!')
+        finally:
+            con.close()
+
+        return len(data)
+
+
+    def repair_gaps(self, db, gaps, interval='8h', limit=1000):
+        """
+        Info:   Fetch only the missing kline ranges found by find_gaps
+        Path:   NA
+        Input:  db       - string    = database name
+                gaps     - dataframe = pair, start_ms, end_ms rows from find_gaps
+                interval - string    = kline interval
+                limit    - int       = candles per request (Binance max 1000)
+        Output: int                  = number of candles written
+        Note:   Gaps of a pair that fit in one page are fetched with a single
+                startTime/endTime request. Ranges still empty after the fetch are
+                recorded in kline_gaps and skipped by later scans.
+        """
+
+        step = interval_ms[interval]
+        written = 0
+        con = lite.connect(db)
+
+        for pair, rows in gaps.sort_values(['pair', 'start_ms']).groupby('pair'):
+            # Coalesce neighbouring gaps into pages of at most limit candles
+            pages = []
+            for start_ms, end_ms in zip(rows.start_ms, rows.end_ms):
+                if pages and end_ms - pages[-1][0] < step * limit:
+                    pages[-1][1] = end_ms
+                else:
+                    pages.append([start_ms, end_ms])
+
+            for start_ms, end_ms in pages:
+                try:
+                    klines = []
+                    page_start = int(start_ms)
+                    while page_start <= end_ms:
+                        page = self.client.get_klines(symbol=pair,
+                                                      interval=interval,
+                                                      startTime=page_start,
+                                                      endTime=int(end_ms),
+                                                      limit=limit)
+                        klines += page
+                        if len(page) < limit:
+                            break
+                        page_start = page[-1][0] + step
+
+                    data = kline_frame(klines)
+                    data = data.loc[data.close_time < self.clock.now_ms()]
+                    written += write_klines(con, db, pair, data, interval)
+
+                    # Whatever is still missing in the requested gaps is empty on the exchange
+                    got = set(data.timestamp.tolist())
+                    for gap_start, gap_end in zip(rows.start_ms, rows.end_ms):
+                        if not start_ms <= gap_start <= end_ms:
+                            continue
+                        hole = None
+                        for ts in range(int(gap_start), int(gap_end) + step, step):
+                            if ts not in got and ts + step <= self.clock.now_ms():
+                                hole = [hole[0] if hole else ts, ts]
+                            elif hole:
+                                mark_empty_gap(con, pair, interval, *hole)
+                                hole = None
+                        if hole:
+                            mark_empty_gap(con, pair, interval, *hole)
+                except Exception as e:
+                    log('log_master_code.log', f'Gap {pair} - {e}',
+                        pair=pair, stage='repair_gaps')
+
+        con.close()
+
+        return written
+
+
     def get_bnc_txn_info(self, db, bnc_txn_tbl, pair):
         """
         Info:   Get transaction information from binance (for commision tracking)
@@ -350,7 +461,8 @@ class Binance:
         con.close()
 
 
-    def gen_txn(self, db, master_tbl, signal_tbl, txn_tbl, map_tbl, txn_time):
+    def gen_txn(self, db, master_tbl, signal_tbl, txn_tbl, map_tbl, txn_time, net=False,
+                pair_list=None):
         """
         Info:   Generate transaction information according to portfolio config from signal
         Path:   NA
@@ -359,8 +471,9 @@ class Binance:
                 signal_tbl   - string = signal table name
                 txn_tbl      - string = transaction table name
                 map_tbl      - string = map table name
-                api_key      - string = api key
-                api_secret   - string = api secret
+                txn_time     - datetime = session timestamp
+                net          - bool   = send one net order per pair instead of one per strategy
+                pair_list    - list   = only trade the signals of these pairs, all if None
         Output: Executing binance order according to signal and portfolio config
                 Log the sucess orders
         """
@@ -372,72 +485,280 @@ class Binance:
         signal_list = pd.read_sql(
             """select * from {0} where timestamp = '{1}'""".format(
                 signal_tbl, txn_time), con)
+        con.close()
+        if pair_list is not None:
+            signal_list = signal_list.loc[signal_list.pair.isin(pair_list)]
 
-        if len(signal_list) != 0:
+        if len(signal_list) != 0 and net:
+            self.gen_netted_txn(db, master_tbl, txn_tbl, map_tbl, txn_time, signal_list)
 
-            # Update system time
-            if platform == "win32":
-                sync_time()
+        elif len(signal_list) != 0:
 
             # Get holding list
-            hold_list = pd.read_sql(
-                """select pair, strategy, qty from {0} where is_sold=0""".format(
-                    txn_tbl), con)
+            hold_list = self.get_hold_list(db, txn_tbl)
 
             # Get sell list in the holding list
-            sell_list = pd.merge(hold_list[['pair', 'qty']],\
-                                signal_list.loc[signal_list.action.isin(['SELL', 'CUT_SELL']), ['pair', 'strategy', 'action']],\
-                                how='inner',\
-                                left_on=['pair'],\
-                                right_on=['pair'])
+            sell_list = self.get_sell_list(hold_list, signal_list)
 
             ## Execute selling signals
-
-            # Iteratively execute selling signals
-            for i, row in sell_list.iterrows():
-                try:
-                    # Get transaction amount
-                    dec_num = get_min_txn(db, map_tbl, row['pair'])
-                    qty = round(
-                        self.get_asset(row['pair'].replace('USDT', '')) - 0.5 / 10**dec_num, dec_num)
-                    if  (qty>float(row['qty'])+2/10**dec_num)\
-                        or (row['pair']=='BNBUSDT' and qty>float(row['qty'])):
-                        qty = row['qty']
-
-                    # Send order to Binance
-                    order = self.create_order(row['pair'], 'SELL', qty)
-
-                    # Log and get transaction information
-                    log_order(db, txn_tbl, order, row['action'], row['strategy'],
-                            txn_time)
-                    self.get_bnc_txn_info(db, 'bnc_' + txn_tbl, row['pair'])
-                except Exception as e:
-                    log('log_master_code.log',
-                        f"SELL - {row['pair']} - {qty} - {e}")
+            self.execute_sells(db, txn_tbl, map_tbl, txn_time, sell_list)
 
             if len(signal_list.loc[signal_list.action == 'BUY']) != 0:
 
                 ## Execute buying signals
 
                 # Distribute transaction amount according to portfolio config
-                txn_amt = round(
-                    self.get_asset('USDT') /
-                    (count_signal(db, master_tbl) - len(hold_list) +
-                    len(sell_list)), 3)
-                log(
-                    'log_master_code.log',
-                    f"BUY\n - Total: {count_signal(db, master_tbl)}\n - Hold: {len(hold_list)}\n - Sell: {len(sell_list)}\n"
-                )
-                for i, row in signal_list.loc[signal_list.action ==
-                                            'BUY'].iterrows():
-                    try:
-                        # Send order to Binance
-                        order = self.create_order(row['pair'], 'BUY', txn_amt)
-
-                        # Log and get transaction information
-                        log_order(db, txn_tbl, order, row['action'],
-                                row['strategy'], txn_time)
-                        self.get_bnc_txn_info(db, 'bnc_' + txn_tbl, row['pair'])
-                    except Exception as e:
-                        log('log_master_code.log',
-                            f"BUY - {row['pair']} - {txn_amt} - {e}")
+                txn_amt = self.get_txn_amt(db, master_tbl, len(hold_list), len(sell_list))
+                self.execute_buys(db, txn_tbl, txn_time,
+                                  signal_list.loc[signal_list.action == 'BUY'], txn_amt)
+
+
+    def gen_netted_txn(self, db, master_tbl, txn_tbl, map_tbl, txn_time, signal_list):
+        """
+        Info:   Execute the signals of a session with one net order per pair
+        Path:   NA
+        Input:  db          - string    = database name
+                master_tbl  - string    = master table name
+                txn_tbl     - string    = transaction table name
+                map_tbl     - string    = map table name
+                txn_time    - datetime  = session timestamp
+                signal_list - dataframe = signals of the session
+        Output: Executing binance orders, each strategy's share logged in txn_tbl
+        Note:   Pairs with only SELLs go first so their USDT is free for BUY sizing, the
+                USDT that SELLs of pairs with BUYs would free is added at the ticker price
+        """
+
+        hold_list = self.get_hold_list(db, txn_tbl)
+        sell_list = self.get_net_sell_list(hold_list, signal_list)
+        buy_list = signal_list.loc[signal_list.action == 'BUY']
+
+        crossed = sell_list.pair.isin(buy_list.pair)
+        for pair in sell_list.loc[~crossed, 'pair'].unique():
+            self.execute_net_order(db, txn_tbl, map_tbl, txn_time, pair,
+                                   sell_list.loc[sell_list.pair == pair], buy_list.iloc[:0], 0)
+
+        if len(buy_list) != 0:
+            txn_amt = self.get_txn_amt(db, master_tbl, len(hold_list), len(sell_list),
+                                       self.get_freed(sell_list.loc[crossed]))
+
+            for pair in buy_list.pair.unique():
+                self.execute_net_order(db, txn_tbl, map_tbl, txn_time, pair,
+                                       sell_list.loc[sell_list.pair == pair],
+                                       buy_list.loc[buy_list.pair == pair], txn_amt)
+
+
+    def execute_net_order(self, db, txn_tbl, map_tbl, txn_time, pair, sells, buys, txn_amt):
+        """
+        Info:   Net the SELLs and BUYs of one pair into a single market order
+        Path:   NA
+        Input:  db       - string    = database name
+                txn_tbl  - string    = transaction table name
+                map_tbl  - string    = map table name
+                txn_time - datetime  = session timestamp
+                pair     - string    = pair name
+                sells    - dataframe = pair, strategy, qty, action of the positions to sell
+                buys     - dataframe = BUY signals of the pair
+                txn_amt  - float     = quote amount per BUY
+        Output: One exchange order (none if the residual is below min_notional or the lot
+                size), the fill is split pro rata over the strategies with net_fills and
+                every strategy is logged with log_order
+        """
+
+        order = None
+        try:
+            dec_num = get_min_txn(db, map_tbl, pair)
+            sell_qty = sells['qty'].astype(float).to_numpy()
+            buy_quote = np.full(len(buys), float(txn_amt))
+
+            if len(sells) != 0:
+                # Same dust rule as execute_sells: sweep the balance unless it is much larger
+                held = round(self.get_asset(pair.replace('USDT', '')) - 0.5 / 10**dec_num, dec_num)
+                total = sell_qty.sum()
+                if not (held > total + 2 / 10**dec_num or (pair == 'BNBUSDT' and held > total)):
+                    sell_qty = sell_qty * held / total
+
+            price = float(self.client.get_symbol_ticker(symbol=pair)['price'])
+            net_quote = buy_quote.sum() - sell_qty.sum() * price
+            net_qty = round(abs(net_quote) / price, dec_num)
+
+            # A residual the exchange would reject is left in the wallet, the cross is still logged
+            if abs(net_quote) >= self.min_notional and net_qty != 0:
+                if net_quote > 0:
+                    order = self.create_order(pair, 'BUY', round(net_quote, 3))
+                else:
+                    order = self.create_order(pair, 'SELL', net_qty)
+
+            sell_orders, buy_orders = net_fills(order, pair, price, sell_qty, buy_quote,
+                                                self.clock.now_ms())
+
+            for fill, (i, row) in zip(sell_orders, sells.iterrows()):
+                log_order(db, txn_tbl, fill, row['action'], row['strategy'], txn_time)
+                log_execution(db, fill, row['action'], row['strategy'], txn_time,
+                              row.get('sell_price'), self.signal_ms)
+            for fill, (i, row) in zip(buy_orders, buys.iterrows()):
+                log_order(db, txn_tbl, fill, row['action'], row['strategy'], txn_time)
+                log_execution(db, fill, row['action'], row['strategy'], txn_time,
+                              row.get('buy_price'), self.signal_ms)
+
+            if order is not None:
+                self.get_bnc_txn_info(db, 'bnc_' + txn_tbl, pair)
+            log('log_master_code.log',
+                f"NET - {pair} - {len(sells)} sells, {len(buys)} buys - {order and order['side']}",
+                pair=pair, stage='NET', orders=int(order is not None),
+                strategies=len(sells) + len(buys))
+        except Exception as e:
+            log('log_master_code.log', f"NET - {pair} - {e}", pair=pair, stage='NET')
+
+
+    def get_hold_list(self, db, txn_tbl):
+        """
+        Info:   Get the open positions
+        Path:   NA
+        Input:  db      - string = database name
+                txn_tbl - string = transaction table name
+        Output: dataframe        = pair, strategy, qty of the positions not sold yet
+        """
+
+        con = lite.connect(db)
+        hold_list = pd.read_sql(
+            """select pair, strategy, qty from {0} where is_sold=0""".format(
+                txn_tbl), con)
+        con.close()
+
+        return hold_list
+
+
+    def get_net_sell_list(self, hold_list, signal_list):
+        """
+        Info:   Get the SELL/CUT_SELL signals of the strategies holding a position
+        Path:   NA
+        Input:  hold_list   - dataframe = open positions
+                signal_list - dataframe = signals of the session
+        Output: dataframe               = pair, strategy, qty, action, sell_price, one row per position
+        """
+
+        return pd.merge(hold_list[['pair', 'strategy', 'qty']],
+                        signal_list.loc[signal_list.action.isin(['SELL', 'CUT_SELL']),
+                                        ['pair', 'strategy', 'action', 'sell_price']],
+                        how='inner',
+                        on=['pair', 'strategy'])
+
+
+    def get_freed(self, sell_list):
+        """
+        Info:   USDT the positions of a sell list are worth at the ticker price
+        Path:   NA
+        Input:  sell_list - dataframe = rows of get_net_sell_list
+        Output: float
+        """
+
+        return sum(
+            float(row['qty']) * float(self.client.get_symbol_ticker(symbol=row['pair'])['price'])
+            for i, row in sell_list.iterrows())
+
+
+    def get_sell_list(self, hold_list, signal_list):
+        """
+        Info:   Get the SELL/CUT_SELL signals of pairs in the holding list
+        Path:   NA
+        Input:  hold_list   - dataframe = open positions
+                signal_list - dataframe = signals of the session
+        Output: dataframe               = pair, qty, strategy, action, sell_price
+        """
+
+        return pd.merge(hold_list[['pair', 'qty']],\
+                        signal_list.loc[signal_list.action.isin(['SELL', 'CUT_SELL']), ['pair', 'strategy', 'action', 'sell_price']],\
+                        how='inner',\
+                        left_on=['pair'],\
+                        right_on=['pair'])
+
+
+    def execute_sells(self, db, txn_tbl, map_tbl, txn_time, sell_list):
+        """
+        Info:   Send the sell orders and log them
+        Path:   NA
+        Input:  db        - string    = database name
+                txn_tbl   - string    = transaction table name
+                map_tbl   - string    = map table name
+                txn_time  - datetime  = session timestamp
+                sell_list - dataframe = rows of get_sell_list
+        Output: Executing binance orders, logged in txn_tbl
+        """
+
+        # Iteratively execute selling signals
+        for i, row in sell_list.iterrows():
+            qty = None
+            try:
+                # Get transaction amount
+                dec_num = get_min_txn(db, map_tbl, row['pair'])
+                qty = round(
+                    self.get_asset(row['pair'].replace('USDT', '')) - 0.5 / 10**dec_num, dec_num)
+                if  (qty>float(row['qty'])+2/10**dec_num)\
+                    or (row['pair']=='BNBUSDT' and qty>float(row['qty'])):
+                    qty = row['qty']
+
+                # Send order to Binance
+                order = self.create_order(row['pair'], 'SELL', qty)
+
+                # Log and get transaction information
+                log_order(db, txn_tbl, order, row['action'], row['strategy'],
+                        txn_time)
+                log_execution(db, order, row['action'], row['strategy'], txn_time,
+                              row.get('sell_price'), self.signal_ms)
+                self.get_bnc_txn_info(db, 'bnc_' + txn_tbl, row['pair'])
+            except Exception as e:
+                log('log_master_code.log',
+                    f"SELL - {row['pair']} - {qty} - {e}",
+                    pair=row['pair'], stage='SELL')
+
+
+    def get_txn_amt(self, db, master_tbl, n_hold, n_sell, freed=0):
+        """
+        Info:   USDT given to each BUY: free USDT shared among the strategies without position
+        Path:   NA
+        Input:  db         - string = database name
+                master_tbl - string = master table name
+                n_hold     - int    = open positions before the session
+                n_sell     - int    = positions sold in the session
+                freed      - float  = USDT of netted SELLs not sent yet, see get_freed
+        Output: float               = quote amount per BUY order
+        """
+
+        txn_amt = round(
+            (self.get_asset('USDT') + freed) /
+            (count_signal(db, master_tbl) - n_hold + n_sell), 3)
+        log(
+            'log_master_code.log',
+            f"BUY{' (netted)' if freed else ''}\n - Total: {count_signal(db, master_tbl)}\n - Hold: {n_hold}\n - Sell: {n_sell}\n"
+        )
+
+        return txn_amt
+
+
+    def execute_buys(self, db, txn_tbl, txn_time, buy_list, txn_amt):
+        """
+        Info:   Send the buy orders and log them
+        Path:   NA
+        Input:  db       - string    = database name
+                txn_tbl  - string    = transaction table name
+                txn_time - datetime  = session timestamp
+                buy_list - dataframe = BUY signals
+                txn_amt  - float     = quote amount per order
+        Output: Executing binance orders, logged in txn_tbl
+        """
+
+        for i, row in buy_list.iterrows():
+            try:
+                # Send order to Binance
+                order = self.create_order(row['pair'], 'BUY', txn_amt)
+
+                # Log and get transaction information
+                log_order(db, txn_tbl, order, row['action'],
+                        row['strategy'], txn_time)
+                log_execution(db, order, row['action'], row['strategy'], txn_time,
+                              row.get('buy_price'), self.signal_ms)
+                self.get_bnc_txn_info(db, 'bnc_' + txn_tbl, row['pair'])
+            except Exception as e:
+                log('log_master_code.log',
+                    f"BUY - {row['pair']} - {txn_amt} - {e}",
+                    pair=row['pair'], stage='BUY')
@@ -0,0 +1,159 @@
+###########################################################################################################################################
+# SERVER CLOCK OFFSET
+###########################################################################################################################################
+
+import socket
+import struct
+import threading
+import time
+
+TIME1970 = 2208988800  # Seconds between the NTP epoch (1900) and the Unix epoch
+
+
+def ntp_time(addr, timeout=2.0):
+    """
+    Info:   Query a NTP server with a single SNTP packet
+    Path:   NA
+    Input:  addr    - string = NTP server address
+            timeout - float  = socket timeout in seconds
+    Output: float            = server epoch time in seconds, None if no response
+    """
+
+    # http://code.activestate.com/recipes/117211-simple-very-sntp-client/
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    data = ('\x1b' + 47 * '\0').encode()
+    try:
+        client.settimeout(timeout)
+        client.sendto(data, (addr, 123))
+        data, address = client.recvfrom(1024)
+    except (socket.timeout, OSError):
+        return None
+    finally:
+        client.close()
+
+    if len(data) < 48:
+        return None
+    words = struct.unpack('!12I', data[:48])
+
+    return words[10] - TIME1970 + words[11] / 2**32
+
+
+class ServerClock:
+    """
+    Info:   Keep a smoothed offset between the local clock and the exchange clock
+    Path:   NA
+    Note:   Samples run in a daemon thread, so callers never wait on time sync.
+            offset = server time - local midpoint of the request, in ms.
+            Every attached client gets its timestamp_offset refreshed after each
+            sample, which python-binance adds to the timestamp of signed requests.
+    """
+
+    def __init__(self,
+                 server_time=None,
+                 interval=60,
+                 alpha=0.2,
+                 ntp_hosts=('pool.ntp.org', 'time.google.com', 'time.nist.gov')):
+        """
+        Input:  server_time - callable = returns the exchange time in epoch ms
+                interval    - float    = seconds between two samples
+                alpha       - float    = weight of a new sample in the smoothed offset
+                ntp_hosts   - tuple    = NTP servers used when server_time fails
+        """
+        self.server_time = server_time
+        self.interval = interval
+        self.alpha = alpha
+        self.ntp_hosts = ntp_hosts
+
+        self.offset = 0.0
+        self.rtt = None
+        self.last_sync = None
+        self.clients = []
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, client):
+        """
+        Info:   Register a python-binance client whose timestamps follow the offset
+        Input:  client - Client/AsyncClient = binance client
+        """
+        self.clients.append(client)
+        client.timestamp_offset = int(self.offset)
+
+    def _sample_exchange(self):
+        t0 = time.time()
+        server = self.server_time()
+        t1 = time.time()
+        return server - (t0 + t1) * 500, (t1 - t0) * 1000
+
+    def _sample_ntp(self):
+        for addr in self.ntp_hosts:
+            t0 = time.time()
+            server = ntp_time(addr)
+            t1 = time.time()
+            if server is not None:
+                return (server - (t0 + t1) / 2) * 1000, (t1 - t0) * 1000
+        return None
+
+    def sample(self):
+        """
+        Info:   Take one offset sample, the exchange first then the NTP servers
+        Output: True/False = whether a sample was taken
+        """
+
+        sample = None
+        if self.server_time is not None:
+            try:
+                sample = self._sample_exchange()
+            except Exception:
+                sample = None
+        if sample is None:
+            sample = self._sample_ntp()
+        if sample is None:
+            return False
+
+        offset, rtt = sample
+        with self._lock:
+            if self.rtt is None:
+                self.offset, self.rtt = offset, rtt
+            else:
+                # A slow round trip gives a loose bound on the offset, trust it less
+                weight = self.alpha if rtt <= 2 * self.rtt else self.alpha / 4
+                self.offset += weight * (offset - self.offset)
+                self.rtt += self.alpha * (rtt - self.rtt)
+            self.last_sync = time.time()
+
+            for client in self.clients:
+                client.timestamp_offset = int(self.offset)
+
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """
+        Info:   Start sampling in the background
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='server-clock',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Info:   Stop sampling
+        """
+        self._stop.set()
+
+    def now_ms(self):
+        """
+        Info:   Current exchange time estimate
+        Output: int = epoch ms
+        """
+        return int(time.time() * 1000 + self.offset)
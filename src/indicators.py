@@ -0,0 +1,306 @@
+###########################################################################################################################################
+# INDICATORS
+###########################################################################################################################################
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _panel(x):
+    x = np.asarray(x, dtype='float64')
+    return x.reshape(len(x), -1), x.ndim == 1
+
+
+def ema(x, span=None, alpha=None):
+    """
+    Info:   Exponential moving average over a price series or a time x pair panel
+    Path:   NA
+    Input:  x     - ndarray = prices, 1-D (time) or 2-D (time x pair), NaN for missing candles
+            span  - int     = EMA span, alpha = 2 / (span + 1)
+            alpha - float   = smoothing factor, used instead of span (1 / n for Wilder smoothing)
+    Output: ndarray         = EMA with the shape of x
+    Note:   Same values as pandas ewm(adjust=False).mean(): starts at the first valid
+            price of each column and skipped candles decay the previous value
+    """
+
+    x, flat = _panel(x)
+    if alpha is None:
+        alpha = 2 / (span + 1)
+    if len(x) == 0:
+        return x[:, 0] if flat else x
+
+    # Fast path: the valid prices of each column are one contiguous block
+    valid = ~np.isnan(x)
+    start = valid.argmax(axis=0)
+    last = len(x) - 1 - valid[::-1].argmax(axis=0)
+    if (valid.sum(axis=0) == last - start + 1).all():
+        cols = np.arange(x.shape[1])
+        filled = np.where(valid, x, x[start, cols])
+        out = np.empty_like(x)
+        if x.shape[1] == 1:
+            y = filled[0, 0]
+            col = out[:, 0]
+            for t, cur in enumerate(filled[:, 0].tolist()):
+                y += alpha * (cur - y)
+                col[t] = y
+        else:
+            y = filled[0].copy()
+            for t in range(len(x)):
+                y += alpha * (filled[t] - y)
+                out[t] = y
+        t = np.arange(len(x))[:, None]
+        out = np.where(t > last, out[last, cols], out)
+        out[t < start] = np.nan
+        return out[:, 0] if flat else out
+
+    out = np.empty_like(x)
+    weighted = x[0].copy()
+    old_wt = np.ones(x.shape[1])
+    out[0] = weighted
+
+    for t in range(1, len(x)):
+        cur = x[t]
+        obs = ~np.isnan(cur)
+        started = ~np.isnan(weighted)
+
+        old_wt = np.where(started, old_wt * (1 - alpha), old_wt)
+        upd = started & obs
+        weighted = np.where(
+            upd, (old_wt * weighted + alpha * np.where(obs, cur, 0.0)) / (old_wt + alpha),
+            weighted)
+        old_wt = np.where(upd, 1.0, old_wt)
+        weighted = np.where(~started & obs, cur, weighted)
+        out[t] = weighted
+
+    return out[:, 0] if flat else out
+
+
+def _rolling_sum(x, n):
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=0)
+    ccount = np.cumsum(valid, axis=0)
+    csum[n:] = csum[n:] - csum[:-n].copy()
+    ccount[n:] = ccount[n:] - ccount[:-n].copy()
+    return csum, ccount
+
+
+def sma(x, n):
+    """
+    Info:   Simple moving average
+    Path:   NA
+    Input:  x - ndarray = prices, 1-D or 2-D (time x pair)
+            n - int     = window length
+    Output: ndarray     = SMA, NaN until a window has n valid prices
+    """
+
+    x, flat = _panel(x)
+    csum, ccount = _rolling_sum(x, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = np.where(ccount == n, csum / n, np.nan)
+    return out[:, 0] if flat else out
+
+
+def rolling_std(x, n):
+    """
+    Info:   Rolling sample standard deviation (ddof=1, like pandas rolling().std())
+    Path:   NA
+    Input:  x - ndarray = prices, 1-D or 2-D (time x pair)
+            n - int     = window length
+    Output: ndarray     = standard deviation, NaN until a window has n valid prices
+    """
+
+    x, flat = _panel(x)
+    csum, ccount = _rolling_sum(x, n)
+    csq, _ = _rolling_sum(x * x, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (csq - csum * csum / n) / (n - 1)
+        out = np.where(ccount == n, np.sqrt(np.maximum(var, 0.0)), np.nan)
+    return out[:, 0] if flat else out
+
+
+def rsi(x, n=14):
+    """
+    Info:   Relative strength index with Wilder smoothing
+    Path:   NA
+    Input:  x - ndarray = prices, 1-D or 2-D (time x pair)
+            n - int     = period
+    Output: ndarray     = RSI between 0 and 100, NaN on the first candle
+    """
+
+    x, flat = _panel(x)
+    diff = np.full_like(x, np.nan)
+    diff[1:] = x[1:] - x[:-1]
+    gain = ema(np.where(np.isnan(diff), np.nan, np.maximum(diff, 0)), alpha=1 / n)
+    loss = ema(np.where(np.isnan(diff), np.nan, np.maximum(-diff, 0)), alpha=1 / n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+    out = np.where(np.isnan(gain), np.nan, out)
+    return out[:, 0] if flat else out
+
+
+def atr(high, low, close, n=14):
+    """
+    Info:   Average true range with Wilder smoothing
+    Path:   NA
+    Input:  high  - ndarray = high prices, 1-D or 2-D (time x pair)
+            low   - ndarray = low prices
+            close - ndarray = close prices
+            n     - int     = period
+    Output: ndarray         = ATR
+    """
+
+    high, flat = _panel(high)
+    low, _ = _panel(low)
+    close, _ = _panel(close)
+    prev = np.full_like(close, np.nan)
+    prev[1:] = close[:-1]
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev), np.abs(low - prev)))
+    out = ema(tr, alpha=1 / n)
+    return out[:, 0] if flat else out
+
+
+def bollinger(x, n=20, k=2):
+    """
+    Info:   Bollinger bands
+    Path:   NA
+    Input:  x - ndarray = prices, 1-D or 2-D (time x pair)
+            n - int     = window length
+            k - float   = number of standard deviations
+    Output: tuple       = (middle, upper, lower) bands
+    """
+
+    mid = sma(x, n)
+    std = rolling_std(x, n)
+    return mid, mid + k * std, mid - k * std
+
+
+def macd(x, fast=12, slow=26, signal=9):
+    """
+    Info:   Moving average convergence divergence
+    Path:   NA
+    Input:  x      - ndarray = prices, 1-D or 2-D (time x pair)
+            fast   - int     = fast EMA span
+            slow   - int     = slow EMA span
+            signal - int     = signal line EMA span
+    Output: tuple            = (macd, signal, histogram)
+    """
+
+    line = ema(x, fast) - ema(x, slow)
+    sig = ema(line, signal)
+    return line, sig, line - sig
+
+
+class IndicatorCache:
+    """
+    Info:   LRU cache of indicator series keyed by (pair, indicator, params, first candle, last candle)
+    Path:   path (optional)
+    Note:   With a path, every computed series is also saved as .npy and a later miss
+            in memory loads it back memory-mapped, so other runs reuse it. The window moves
+            with every new candle, so the directory is pruned to the max_files most
+            recently used files (by mtime, refreshed on a disk hit).
+    """
+
+    def __init__(self, max_items=256, path=None, max_files=1024):
+        """
+        Input:  max_items - int    = series kept in memory
+                path      - string = directory of the on-disk cache, memory only if None
+                max_files - int    = .npy files kept in path
+        """
+        self.max_items = max_items
+        self.path = path
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def _file(self, key):
+        return os.path.join(self.path,
+                            hashlib.sha1(repr(key).encode()).hexdigest() + '.npy')
+
+    def get(self, key):
+        """
+        Output: ndarray = cached series, None if missing
+        """
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+        if self.path is not None and os.path.exists(self._file(key)):
+            value = np.load(self._file(key), mmap_mode='r')
+            self._touch(self._file(key))
+            self.put(key, value, persist=False)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, persist=True):
+        """
+        Info:   Store a series, evicting the least recently used one when full
+        """
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        if persist and self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            tmp = self._file(key) + '.tmp.npy'
+            np.save(tmp, value)
+            os.replace(tmp, self._file(key))
+            self.prune()
+
+    def _touch(self, file):
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+
+    def prune(self):
+        """
+        Info:   Delete the least recently used .npy files over max_files
+        Output: int = files deleted
+        """
+        if self.path is None or not os.path.isdir(self.path):
+            return 0
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npy') and not entry.name.endswith('.tmp.npy'):
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        deleted = 0
+        for _, file in sorted(files)[:max(len(files) - self.max_files, 0)]:
+            # Another process may prune the same file
+            try:
+                os.remove(file)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def compute(self, pair, name, params, first_ts, last_ts, func, *args):
+        """
+        Info:   Get an indicator series from the cache or compute and store it
+        Path:   NA
+        Input:  pair     - string   = pair name
+                name     - string   = indicator name
+                params   - tuple    = indicator parameters
+                first_ts - any      = first candle of the input window
+                last_ts  - any      = last candle of the input window
+                func     - callable = indicator kernel
+                args     - ndarray  = kernel inputs
+        Output: ndarray             = indicator series
+        """
+        key = (pair, name, tuple(params), str(first_ts), str(last_ts))
+        value = self.get(key)
+        if value is None:
+            value = func(*args, *params)
+            self.put(key, value)
+        return value
+
+
+cache = IndicatorCache()
@@ -0,0 +1,153 @@
+###########################################################################################################################################
+# BUFFERED LOGGER
+###########################################################################################################################################
+
+import atexit
+import datetime as dt
+import os
+import queue
+import threading
+import time
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+class BufferedLogger:
+    """
+    Info:   Log file written by a background thread
+    Path:   NA
+    Note:   log() only puts the record on a queue, the writer
+            thread formats, writes and flushes records in batches and rotates the
+            file once it grows over max_bytes (file, file.1, ..., file.<backup_count>).
+            When the queue is full records are dropped and counted instead of blocking.
+    """
+
+    def __init__(self,
+                 file,
+                 max_bytes=5 * 1024 * 1024,
+                 backup_count=5,
+                 flush_interval=1.0,
+                 batch_size=512,
+                 queue_size=10000):
+        """
+        Input:  file           - string = output log file name
+                max_bytes      - int    = file size that triggers a rotation, 0 to disable
+                backup_count   - int    = number of rotated files kept
+                flush_interval - float  = max seconds a record waits before being written
+                batch_size     - int    = max records written per flush
+                queue_size     - int    = max records waiting in memory
+        """
+        self.file = file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stream = open(file, 'a+')
+        self._thread = threading.Thread(target=self._run,
+                                        name='logger-' + os.path.basename(file),
+                                        daemon=True)
+        self._thread.start()
+
+    def log(self, string, **fields):
+        """
+        Info:   Queue a log line
+        Input:  string - string = content to be logged
+                fields - kwargs = structured fields appended as key=value (pair, stage, latency...)
+        """
+        try:
+            self._queue.put_nowait((time.time(), string, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def _format(self, record):
+        ts, string, fields = record
+        line = '{0} - {1}'.format(
+            str(dt.datetime.utcfromtimestamp(ts) + dt.timedelta(hours=7)),
+            string)
+        if fields:
+            line += ' | ' + ' '.join('{0}={1}'.format(k, v)
+                                     for k, v in fields.items())
+        return line + '\n'
+
+    def _rotate(self):
+        self._stream.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = '{0}.{1}'.format(self.file, i)
+            if os.path.exists(src):
+                os.replace(src, '{0}.{1}'.format(self.file, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.file, self.file + '.1')
+        else:
+            os.remove(self.file)
+        self._stream = open(self.file, 'a+')
+
+    def _write(self, batch):
+        if self.dropped:
+            batch.append((time.time(),
+                          'Logger dropped {0} records'.format(self.dropped),
+                          {}))
+            self.dropped = 0
+        self._stream.write(''.join(self._format(r) for r in batch))
+        self._stream.flush()
+        if self.max_bytes and self._stream.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = [r for r in batch if r is not None]
+            if batch:
+                self._write(batch)
+
+    def close(self):
+        """
+        Info:   Write every queued record and close the file
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+            self._stream.close()
+
+
+def get_logger(file):
+    """
+    Info:   Get the buffered logger of a log file, created on first use
+    Path:   NA
+    Input:  file - string = log file name
+    Output: BufferedLogger
+    """
+
+    logger = _loggers.get(file)
+    if logger is None:
+        with _loggers_lock:
+            logger = _loggers.get(file)
+            if logger is None:
+                logger = BufferedLogger(file)
+                _loggers[file] = logger
+    return logger
+
+
+@atexit.register
+def shutdown():
+    """
+    Info:   Flush and close every logger, registered to run at exit
+    """
+    with _loggers_lock:
+        for logger in _loggers.values():
+            logger.close()
+        _loggers.clear()
@@ -1,29 +1,210 @@
+import os
 import pandas as pd
 from sqlite3 import connect
 import time
+import argparse
 from datetime import datetime as dt
 import utils as lib
+import indicators as ind
 from binance import Binance
+import shard
+import profiling
+import preclose
+import pipeline
+from status import Snapshot
 import configparser
 
 
-def main():
+def read_config(config_file='config.ini'):
+    """
+    Info:   Read the configuration file
+    Path:   NA
+    Input:  config_file - string = configuration file
+    Output: ConfigParser
+    """
 
     # Create a ConfigParser object
     config = configparser.ConfigParser()
 
     # Read the configuration file
-    config.read('config.ini')
+    config.read(config_file)
+
+    return config
+
+
+def get_db(config, section='binance'):
+    """
+    Info:   Get the database of a portfolio, [db] db_name unless the section has its own
+    Path:   NA
+    Input:  config  - ConfigParser = configuration
+            section - string       = portfolio config section
+    Output: string                 = database name
+    """
+    return config.get(section, 'db_name', fallback=config.get('db', 'db_name'))
+
+
+def get_status_file(config, section='binance'):
+    """
+    Info:   Get the status snapshot file of a portfolio, [status] file with the section name
+            added for the portfolio.<name> sections unless the section has its own status_file
+    Path:   NA
+    Input:  config  - ConfigParser = configuration
+            section - string       = portfolio config section
+    """
+    file = config.get('status', 'file', fallback='status.json')
+    if section != 'binance':
+        root, ext = os.path.splitext(file)
+        file = '{0}.{1}{2}'.format(root, section, ext)
+    return config.get(section, 'status_file', fallback=file)
+
+
+def get_binance(config, section='binance', mock=False):
+    """
+    Info:   Create the Binance endpoint of a portfolio
+    Path:   NA
+    Input:  config  - ConfigParser = configuration
+            section - string       = portfolio config section with api_key and api_secret
+            mock    - bool         = use the mock exchange
+    Output: Binance
+    """
+
+    cls = Binance
+    if mock:
+        from mock import MockBinance as cls
 
     # YOUR API KEYS HERE
-    api_key = config.get('binance', 'api_key')
-    api_secret = config.get('binance', 'api_secret')
+    return cls(api_key=config.get(section, 'api_key'),
+               api_secret=config.get(section, 'api_secret'),
+               clock_interval=config.getint('clock', 'interval', fallback=60),
+               min_notional=config.getfloat('txn', 'min_notional', fallback=10.0))
+
+
+def configure_profiler(config, stages=None):
+    """
+    Info:   Set up the stage profiler from the [profile] config section
+    Path:   NA
+    Input:  config - ConfigParser = configuration
+            stages - string       = comma separated stages, overrides [profile] stages if given
+    Output: NA, profiling.profiler is configured
+    """
+
+    stages = config.get('profile', 'stages', fallback='') if stages is None else stages
+    stages = [s.strip() for s in stages.split(',') if s.strip()]
+    if 'all' in stages:
+        stages = profiling.stage_names
+
+    profiler = profiling.profiler
+    profiler.stages = set(stages)
+    profiler.mode = config.get('profile', 'mode', fallback='sample')
+    profiler.path = config.get('profile', 'dir', fallback='profiles')
+    profiler.interval = config.getfloat('profile', 'interval', fallback=0.005)
+    profiler.top_n = config.getint('profile', 'top_n', fallback=25)
+    profiler.memory = config.getboolean('profile', 'memory', fallback=True)
+
+
+def update_data(bnc, db, pair_list, txn_time, log_file, retries=None, repair=True):
+    """
+    Info:   Fetch klines until every pair has the latest candle
+    Path:   NA
+    Input:  bnc       - Binance  = exchange endpoint
+            db        - string   = database name
+            pair_list - list     = pairs to be updated
+            txn_time  - datetime = latest transaction time
+            log_file  - string   = log file name
+            retries   - int      = max number of fetch rounds, no limit if None
+            repair    - bool     = fetch the missing ranges inside the stored history afterwards
+    Output: int                  = number of pairs with the latest candle
+    """
+
+    num_of_complete = 0
+    retry = 0
+    rounds = 0
+
+    while num_of_complete != len(pair_list):
+        if retries is not None and rounds == retries:
+            break
+        if retry == 3:
+            lib.log(log_file, f'Warning - completeness: {num_of_complete}')
+            time.sleep(20)
+            retry = 0
+
+        with profiling.stage('get_data'):
+            bnc.get_data(db=db,
+                        pair_list=pair_list)
+        with profiling.stage('check_completeness'):
+            num_of_complete = lib.check_completeness(db=db,
+                                                    pair_list=pair_list,
+                                                    latest_txn_time=txn_time)
+
+        retry += 1
+        rounds += 1
+
+    if repair:
+        gaps = lib.find_gaps(db, pair_list)
+        if len(gaps) != 0:
+            written = bnc.repair_gaps(db, gaps)
+            lib.log(log_file, f'Repaired gaps: {written}/{gaps.candles.sum()} candles',
+                    stage='repair_gaps', gaps=len(gaps), written=written)
+
+    return num_of_complete
+
+
+def publish_status(snapshot, db, stage, txn_time, signal_tbl=None, txn_tbl=None):
+    """
+    Info:   Refresh the status snapshot after a stage
+    Path:   NA
+    Input:  snapshot   - Snapshot = status snapshot
+            db         - string   = database name
+            stage      - string   = finished stage
+            txn_time   - datetime = latest transaction time
+            signal_tbl - string   = signal table name, the latest batch is published if given
+            txn_tbl    - string   = transaction table name, open positions are published if given
+    Note:   The sections are read from SQLite with one short-lived connection
+    """
+
+    sections = {}
+    if signal_tbl is not None or txn_tbl is not None:
+        con = connect(db)
+        if signal_tbl is not None:
+            sections['signals'] = pd.read_sql(
+                f"select * from {signal_tbl} where timestamp=?", con,
+                params=(str(txn_time), )).to_dict('records')
+        if txn_tbl is not None:
+            sections['positions'] = pd.read_sql(
+                f"select timestamp, pair, strategy, buy_price, qty, quote_qty from {txn_tbl} where is_sold=0",
+                con).to_dict('records')
+        con.close()
+    snapshot.update(stage=stage, txn_time=str(txn_time), **sections)
+
+
+def main(config_file='config.ini',
+         section='binance',
+         mock=False,
+         workers=None,
+         remote_shards=None,
+         report_dir=None,
+         profile=None,
+         pipelined=None):
+
+    config = read_config(config_file)
+    configure_profiler(config, profile)
 
     receiver = config.get('incident', 'email')
-    db = config.get('db', 'db_name')
+    db = get_db(config, section)
     log_file = 'log_master_code.log'
     map_tbl = 'master_tbl'
-    bnc = Binance(api_key=api_key, api_secret=api_secret)
+    bnc = get_binance(config, section, mock)
+    ind.cache.path = config.get('indicators', 'cache_dir', fallback=None) or None
+    ind.cache.max_items = config.getint('indicators', 'max_items', fallback=256)
+    ind.cache.max_files = config.getint('indicators', 'max_files', fallback=1024)
+    ind.cache.prune()
+    snapshot = Snapshot(get_status_file(config, section), log_file)
+
+    workers = config.getint('shard', 'workers', fallback=1) if workers is None else workers
+    remote_shards = config.getint('shard', 'remote_shards', fallback=0) if remote_shards is None else remote_shards
+    report_dir = config.get('shard', 'report_dir', fallback='reports') if report_dir is None else report_dir
+    pipelined = config.getboolean('pipeline', 'enabled', fallback=False) if pipelined is None else pipelined
+    traded = False
 
     try:
         pair_list = pd.read_sql(f'select distinct pair from {map_tbl}',
@@ -33,60 +214,167 @@ def main():
         txn_tbl = 'txn_tbl'
         if not lib.is_tbl_exist(tbl_name=txn_tbl, db=db):
             df = lib.ini_txn_tbl()
-            df.to_sql(txn_tbl, con)
+            df.to_sql(txn_tbl, connect(db))
 
         txn_time = lib.get_latest_txn_time()
     except Exception as err:
         with open(log_file, 'a+') as f:
-            f.write(f'{dt.utcnow()} - {e}\n')
+            f.write(f'{dt.utcnow()} - {err}\n')
         lib.send_err(str(err), 'PARAMETERS')
 
     try:
         lib.log(log_file, f'Transaction time: {txn_time}')
 
-        start = time.time()
-        # Updating data
-        num_of_complete = 0
-        retry = 0
+        if workers > 1 or remote_shards > 0:
+            # Fetching data and generating signals per shard
+            start = time.time()
+            report = shard.run_coordinator(
+                config_file,
+                section,
+                db,
+                txn_time,
+                workers,
+                remote_shards,
+                report_dir,
+                timeout=config.getint('shard', 'timeout', fallback=600),
+                mock=mock)
+            num_of_complete = report['num_of_complete']
+            for i, timings in report['timings'].items():
+                lib.log(log_file, f'Shard {i}: {timings}', stage='shard')
+            lib.log(log_file, f'Getting data and signals: {time.time() - start}',
+                    stage='shards', latency=round(time.time() - start, 3))
+            snapshot.update(timings={'shards': round(time.time() - start, 3)},
+                            fetch={'num_of_complete': num_of_complete,
+                                   'pairs': report['pairs'],
+                                   'shards': report['shards']})
+            bnc.signal_ms = bnc.clock.now_ms()
+            publish_status(snapshot, db, 'gen_ema_signal', txn_time, signal_tbl=signal_tbl)
+        elif pipelined and not preclose.is_traded(db, txn_time):
+            start = time.time()
+            # Fetching, generating signals and trading pair by pair
+            result = pipeline.run_session(
+                bnc, db, pair_list, txn_time, master_tbl, signal_tbl, txn_tbl, map_tbl,
+                buy_deadline=config.getfloat('pipeline', 'buy_deadline', fallback=120),
+                timeout=config.getfloat('pipeline', 'timeout', fallback=900),
+                workers=config.getint('pipeline', 'workers', fallback=8),
+                net=config.getboolean('txn', 'netting', fallback=False))
+            num_of_complete = result['num_of_complete']
+            traded = True
+            lib.log(log_file, f'Pipelined session: {time.time() - start}', stage='pipeline',
+                    latency=result['seconds'], first_order=result['first_order'])
+            snapshot.update(timings={'pipeline': result['seconds'],
+                                     'first_order': result['first_order']},
+                            fetch={'num_of_complete': num_of_complete,
+                                   'pairs': len(pair_list),
+                                   'missing': result['missing']})
+            publish_status(snapshot, db, 'gen_txn', txn_time, signal_tbl=signal_tbl,
+                           txn_tbl=txn_tbl)
+        else:
+            start = time.time()
+            # Updating data
+            num_of_complete = update_data(bnc, db, pair_list, txn_time, log_file,
+                                          repair=config.getboolean('data', 'repair_gaps',
+                                                                   fallback=True))
 
-        while num_of_complete != len(pair_list):
-            if retry == 3:
-                lib.log(log_file, f'Warning - completeness: {num_of_complete}')
-                time.sleep(20)
-                retry = 0
+            lib.log(log_file, f'Getting data: {time.time() - start}',
+                    stage='get_data', latency=round(time.time() - start, 3))
+            last_ts = lib.to_ms(txn_time)
+            snapshot.update(timings={'get_data': round(time.time() - start, 3)},
+                            fetch={'num_of_complete': num_of_complete,
+                                   'pairs': len(pair_list),
+                                   'missing': [p for p in pair_list
+                                               if lib.get_watermark(db, p) is False
+                                               or lib.get_watermark(db, p) < last_ts]})
+            publish_status(snapshot, db, 'get_data', txn_time)
 
-            bnc.get_data(db=db,
-                        pair_list=pair_list)
-            num_of_complete = lib.check_completeness(db=db,
-                                                    pair_list=pair_list,
-                                                    latest_txn_time=txn_time)
+            start = time.time()
+            # Generating signal from data
+            with profiling.stage('gen_ema_signal'):
+                lib.gen_ema_signal(db, master_tbl, None,
+                                   workers=config.getint('signal', 'workers', fallback=1))
+            bnc.signal_ms = bnc.clock.now_ms()
+            lib.log(log_file, f'Generating signals: {time.time() - start}',
+                    stage='gen_ema_signal', latency=round(time.time() - start, 3))
+            snapshot.update(timings={'gen_ema_signal': round(time.time() - start, 3)})
+            publish_status(snapshot, db, 'gen_ema_signal', txn_time, signal_tbl=signal_tbl)
 
-            retry += 1
-
-        lib.log(log_file, f'Getting data: {time.time() - start}')
-
-        start = time.time()
-        # Generating signal from data
-        lib.gen_ema_signal(db, master_tbl, None)
-        lib.log(log_file, f'Generating signals: {time.time() - start}')
+        if not traded:
+            start = time.time()
+            # Generating transactions + log transactions
+            # Pairs already traded at candle close are left out
+            done = preclose.traded_pairs(db, txn_time)
+            if done:
+                lib.log(log_file, f'Traded at candle close: {len(done)}/{len(pair_list)} pairs',
+                        stage='gen_txn')
+            if len(done) < len(pair_list):
+                with profiling.stage('gen_txn'):
+                    bnc.gen_txn(db, master_tbl, signal_tbl, txn_tbl, map_tbl, txn_time,
+                                net=config.getboolean('txn', 'netting', fallback=False),
+                                pair_list=[p for p in pair_list if p not in done] if done else None)
+            lib.log(log_file, f'Doing transactions: {time.time() - start}',
+                    stage='gen_txn', latency=round(time.time() - start, 3))
+            snapshot.update(timings={'gen_txn': round(time.time() - start, 3)})
+            publish_status(snapshot, db, 'gen_txn', txn_time, txn_tbl=txn_tbl)
 
         start = time.time()
-        # Generating transactions + log transactions
-        bnc.gen_txn(db, master_tbl, signal_tbl, txn_tbl, map_tbl, txn_time)
-        lib.log(log_file, f'Doing transactions: {time.time() - start}')
 
         # Generating email report
-        lib.gen_mail(db,
-                    txn_tbl,
-                    signal_tbl,
-                    receiver,
-                    data_quality=num_of_complete,
-                    txn_time=txn_time)
+        with profiling.stage('gen_mail'):
+            lib.gen_mail(db,
+                        txn_tbl,
+                        signal_tbl,
+                        receiver,
+                        data_quality=num_of_complete,
+                        txn_time=txn_time)
+        snapshot.update(stage='gen_mail',
+                        timings={'gen_mail': round(time.time() - start, 3)})
+
+        for report in profiling.profiler.reports:
+            lib.log(log_file, f"Profiled {report['stage']}: {report['path']}",
+                    stage=report['stage'], latency=report['seconds'])
 
     except Exception as err:
         with open(log_file, 'a+') as f:
-            f.write(f'{dt.utcnow()} - {e}\n')
+            f.write(f'{dt.utcnow()} - {err}\n')
         lib.send_err(str(err), txn_time)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='config.ini',
+                        help='configuration file')
+    parser.add_argument('--portfolio', default='binance',
+                        help='config section with the api keys (and db_name) of the portfolio')
+    parser.add_argument('--all-portfolios', action='store_true',
+                        help='run every portfolio.<name> config section in its own process')
+    parser.add_argument('--shard',
+                        help='i/n: only fetch and generate signals of shard i of n and write a report')
+    parser.add_argument('--workers', type=int,
+                        help='number of local shard worker processes')
+    parser.add_argument('--remote-shards', type=int,
+                        help='number of shards run on other hosts')
+    parser.add_argument('--report-dir',
+                        help='directory the shard reports are shared in')
+    parser.add_argument('--mock', action='store_true',
+                        help='use the mock exchange')
+    parser.add_argument('--preclose', action='store_true',
+                        help='precompute signal thresholds on the forming candle and trade at its close')
+    parser.add_argument('--pipeline', action='store_true', default=None,
+                        help='fetch, generate signals and trade each pair as soon as its candle is in')
+    parser.add_argument('--profile',
+                        help='comma separated stages to profile (get_data, check_completeness, '
+                        'gen_ema_signal, gen_txn, gen_mail or all), overrides [profile] stages')
+    args = parser.parse_args()
+
+    if args.shard:
+        i, n = map(int, args.shard.split('/'))
+        shard.run_shard(args.config, args.portfolio, i, n,
+                        args.report_dir or read_config(args.config).get(
+                            'shard', 'report_dir', fallback='reports'),
+                        args.mock)
+    elif args.preclose:
+        preclose.run(args.config, args.portfolio, args.mock)
+    elif args.all_portfolios:
+        shard.run_portfolios(args.config, args.mock)
+    else:
+        main(args.config, args.portfolio, args.mock, args.workers,
+             args.remote_shards, args.report_dir, args.profile, args.pipeline)
@@ -0,0 +1,176 @@
+###########################################################################################################################################
+# MOCK EXCHANGE
+###########################################################################################################################################
+
+import datetime as dt
+import math
+import time
+import zlib
+
+from binance import Binance
+from utils import interval_ms
+
+
+class MockClient:
+    """
+    Info:   In-memory stand-in for python-binance Client, for local runs without an exchange
+    Path:   NA
+    Note:   Prices are a deterministic function of (symbol, candle open time), so every
+            process and every call sees the same history. Orders fill at the price of the
+            forming candle and move the in-process balances.
+    """
+
+    def __init__(self, api_key=None, api_secret=None, balances=None):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.balances = dict(balances or {'USDT': 1000.0})
+        self.trades = []
+        self.timestamp_offset = 0
+        self._order_id = 0
+
+    def get_server_time(self):
+        return {'serverTime': int(time.time() * 1000)}
+
+    def _price(self, symbol, open_ms):
+        phase = zlib.crc32(symbol.encode()) % 1000
+        k = open_ms // interval_ms['1h']
+        noise = (zlib.crc32('{0}{1}'.format(symbol, k).encode()) % 1000) / 1e5
+        return round(
+            (10 + phase / 10) * (1 + 0.2 * math.sin(k / 97 + phase) + noise), 6)
+
+    def get_klines(self, symbol, interval, startTime=None, endTime=None, limit=500):
+        step = interval_ms[interval]
+        now = self.get_server_time()['serverTime']
+        end = min(endTime if endTime is not None else now, now)
+        start = startTime if startTime is not None else end - step * limit
+        start = -(-start // step) * step
+
+        klines = []
+        for open_ms in range(start, end + 1, step):
+            if len(klines) == limit:
+                break
+            o = self._price(symbol, open_ms)
+            c = self._price(symbol, min(open_ms + step, now))
+            klines.append([
+                open_ms, str(o), str(max(o, c) * 1.01), str(min(o, c) * 0.99),
+                str(c), '1000.0', open_ms + step - 1, str(1000 * c), 100,
+                '500.0', str(500 * c), '0'
+            ])
+        return klines
+
+    def get_historical_klines(self, symbol, interval, start_str, end_str=None, limit=1000):
+        to_ms = lambda s: int(
+            dt.datetime.strptime(s, '%d %b %Y %H:%M:%S').replace(
+                tzinfo=dt.timezone.utc).timestamp() * 1000)
+        start = to_ms(start_str)
+        end = to_ms(end_str) if end_str else None
+
+        klines = []
+        while True:
+            page = self.get_klines(symbol, interval, start, end, limit)
+            klines += page
+            if len(page) < limit:
+                return klines
+            start = page[-1][0] + 1
+
+    def get_symbol_ticker(self, symbol):
+        now = self.get_server_time()['serverTime']
+        return {'symbol': symbol, 'price': str(self._price(symbol, now))}
+
+    def get_account(self):
+        return {
+            'balances': [{
+                'asset': k,
+                'free': str(v),
+                'locked': '0'
+            } for k, v in self.balances.items()]
+        }
+
+    def create_order(self, symbol, side, type='MARKET', quantity=None,
+                     quoteOrderQty=None, newOrderRespType='FULL'):
+        price = float(self.get_symbol_ticker(symbol)['price'])
+        asset = symbol.replace('USDT', '')
+
+        if side == 'BUY':
+            quote = min(float(quoteOrderQty), self.balances.get('USDT', 0))
+            qty = round(quote / price, 6)
+            self.balances['USDT'] = self.balances.get('USDT', 0) - quote
+            self.balances[asset] = self.balances.get(asset, 0) + qty
+        else:
+            qty = min(float(quantity), self.balances.get(asset, 0))
+            quote = qty * price
+            self.balances[asset] = self.balances.get(asset, 0) - qty
+            self.balances['USDT'] = self.balances.get('USDT', 0) + quote
+
+        self._order_id += 1
+        order = {
+            'symbol': symbol,
+            'orderId': self._order_id,
+            'orderListId': -1,
+            'transactTime': self.get_server_time()['serverTime'],
+            'price': '0.0',
+            'origQty': str(qty),
+            'executedQty': str(qty),
+            'cummulativeQuoteQty': str(quote),
+            'status': 'FILLED',
+            'type': type,
+            'side': side,
+            'fills': [{
+                'price': str(price),
+                'qty': str(qty),
+                'commission': '0',
+                'commissionAsset': asset
+            }]
+        }
+        self.trades.append({
+            'symbol': symbol,
+            'id': self._order_id,
+            'orderId': self._order_id,
+            'orderListId': -1,
+            'price': str(price),
+            'qty': str(qty),
+            'quoteQty': str(quote),
+            'commission': '0',
+            'commissionAsset': asset,
+            'time': order['transactTime'],
+            'isBuyer': side == 'BUY',
+            'isMaker': False,
+            'isBestMatch': True
+        })
+        return order
+
+    def get_my_trades(self, symbol):
+        return [t for t in self.trades if t['symbol'] == symbol]
+
+
+class MockAsyncClient:
+    """
+    Info:   Async wrapper of MockClient with the AsyncClient calls used by Binance.get_data
+    Path:   NA
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.timestamp_offset = 0
+
+    @classmethod
+    async def create(cls, api_key=None, api_secret=None):
+        return cls(MockClient(api_key, api_secret))
+
+    async def get_klines(self, **kwargs):
+        return self.client.get_klines(**kwargs)
+
+    async def get_historical_klines(self, *args, **kwargs):
+        return self.client.get_historical_klines(*args, **kwargs)
+
+    async def close_connection(self):
+        pass
+
+
+class MockBinance(Binance):
+    """
+    Info:   Binance endpoint class backed by the mock exchange
+    Path:   NA
+    """
+    client_cls = MockClient
+    async_client_cls = MockAsyncClient
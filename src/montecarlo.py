@@ -0,0 +1,206 @@
+###########################################################################################################################################
+# MONTE CARLO ROBUSTNESS
+###########################################################################################################################################
+
+import argparse
+import configparser
+import datetime as dt
+import time
+from sqlite3 import connect
+
+import numpy as np
+import pandas as pd
+
+import indicators as ind
+import utils as lib
+from optimize import grid_simulate
+
+stats_tbl = 'montecarlo_stats'
+quantiles = (5, 25, 50, 75, 95)
+
+
+def block_bootstrap(returns, n_paths, length, block, rng):
+    """
+    Info:   Resample a return series into paths made of contiguous blocks
+    Path:   NA
+    Input:  returns - ndarray   = log returns of the stored candles
+            n_paths - int       = number of paths
+            length  - int       = returns per path
+            block   - int       = candles per block, keeps volatility clusters and trends
+            rng     - Generator = NumPy random generator
+    Output: ndarray             = resampled log returns (length x n_paths)
+    """
+
+    block = min(block, len(returns))
+    n_blocks = -(-length // block)
+    starts = rng.integers(0, len(returns) - block + 1, size=(n_paths, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block)).reshape(n_paths, -1)[:, :length]
+    return returns[idx].T
+
+
+def paths_close(returns, n_paths, length, block, rng):
+    """
+    Info:   Close price paths from block bootstrapped returns, all starting at 1
+    Path:   NA
+    Output: ndarray = close prices (length + 1 x n_paths)
+    Note:   utils.simulate only compares prices with their EMA and returns are
+            relative, so the starting price does not change the results
+    """
+
+    r = block_bootstrap(returns, n_paths, length, block, rng)
+    return np.exp(np.vstack([np.zeros((1, n_paths)), np.cumsum(r, axis=0)]))
+
+
+def simulate_paths(close, spans, cut_losses, warmup):
+    """
+    Info:   Trade every strategy of a pair on every path at once
+    Path:   NA
+    Input:  close      - ndarray = close prices (time x paths)
+            spans      - list    = ema span per strategy
+            cut_losses - list    = cut loss per strategy
+            warmup     - int     = first candles only warm the EMA up
+    Output: A list               = [return per strategy and path; max drawdown per strategy and path],
+                                   both (strategy x paths)
+    """
+
+    n = close.shape[1]
+    emas = {s: ind.ema(close, span=int(s)) for s in set(spans)}
+
+    # One column per (strategy, path), strategy major
+    result, max_dd, _ = grid_simulate(np.tile(close, (1, len(spans))),
+                                      np.hstack([emas[s] for s in spans]),
+                                      np.repeat(np.asarray(cut_losses, dtype='float64'), n),
+                                      start=warmup)
+    return [(result / 100 - 1).reshape(len(spans), n), max_dd.reshape(len(spans), n)]
+
+
+def run_pair(pair, close, strategies, n_paths=2000, horizon=1095, block=30, warmup=150,
+             chunk=250, seed=0):
+    """
+    Info:   Monte Carlo distribution of PnL and drawdown of the strategies of one pair
+    Path:   NA
+    Input:  pair       - string    = pair name
+            close      - ndarray   = stored close prices
+            strategies - dataframe = master_tbl rows of the pair (ema, cut_loss)
+            n_paths    - int       = resampled paths
+            horizon    - int       = candles traded per path
+            block      - int       = candles per bootstrap block
+            warmup     - int       = candles before the horizon, EMA warm up only
+            chunk      - int       = paths evaluated at once, bounds the memory
+            seed       - int       = random seed, the same seed gives the same paths
+    Output: dataframe              = one row per strategy with the distribution statistics
+    Note:   Memory is chunk x (warmup + horizon) x strategies floats a few times over,
+            whatever n_paths is. Only the final return and drawdown of each path are kept.
+    """
+
+    close = np.asarray(close, dtype='float64')
+    close = close[~np.isnan(close)]
+    returns = np.diff(np.log(close))
+    spans = strategies['ema'].astype(int).tolist()
+    cut_losses = strategies['cut_loss'].astype(float).tolist()
+
+    rng = np.random.default_rng([seed, sum(map(ord, pair))])
+    pnl, dd = [], []
+    for done in range(0, n_paths, chunk):
+        paths = paths_close(returns, min(chunk, n_paths - done), warmup + horizon - 1, block, rng)
+        chunk_pnl, chunk_dd = simulate_paths(paths, spans, cut_losses, warmup)
+        pnl.append(chunk_pnl)
+        dd.append(chunk_dd)
+    pnl, dd = np.hstack(pnl), np.hstack(dd)
+
+    # The one historical path over the same horizon, for comparison
+    hist = close[-(warmup + horizon):]
+    hist_pnl, hist_dd = simulate_paths(hist[:, None], spans, cut_losses, min(warmup, len(hist) - 1))
+
+    stats = pd.DataFrame({
+        'pair': pair,
+        'strategy': [str(e) + str(c) for e, c in zip(strategies['ema'], strategies['cut_loss'])],
+        'paths': pnl.shape[1],
+        'pnl_mean': pnl.mean(axis=1),
+        'loss_prob': (pnl < 0).mean(axis=1),
+        'hist_pnl': hist_pnl[:, 0],
+        'hist_max_dd': hist_dd[:, 0]
+    })
+    for q, values in zip(quantiles, np.percentile(pnl, quantiles, axis=1)):
+        stats['pnl_p{0}'.format(q)] = values
+    for q, values in zip(quantiles, np.percentile(dd, quantiles, axis=1)):
+        stats['dd_p{0}'.format(q)] = values
+    stats['dd_max'] = dd.max(axis=1)
+
+    return stats
+
+
+def run(db, master_tbl='master_tbl', run_id=None, n_paths=2000, horizon=1095, block=30,
+        warmup=150, chunk=250, seed=0, log_file='log_master_code.log'):
+    """
+    Info:   Monte Carlo robustness report of every master_tbl strategy
+    Path:   NA
+    Input:  db         - string = database name
+            master_tbl - string = master table name
+            run_id     - string = run name, today (YYYYMMDD) if None, a rerun replaces it
+            n_paths    - int    = resampled paths per pair
+            horizon    - int    = candles traded per path
+            block      - int    = candles per bootstrap block
+            warmup     - int    = candles before the horizon, EMA warm up only
+            chunk      - int    = paths evaluated at once
+            seed       - int    = random seed
+            log_file   - string = log file name
+    Output: dataframe           = statistics per strategy, also written to montecarlo_stats
+    Note:   Returns are fractions of the starting budget, drawdowns fractions of the peak.
+            Pairs are run one at a time in this process, each committed on its own.
+    """
+
+    run_id = run_id or dt.datetime.utcnow().strftime('%Y%m%d')
+    df_master = lib.get_master_data(db, master_tbl)
+
+    con = connect(db)
+    reports = []
+    for pair, strategies in df_master.groupby('pair', sort=False):
+        start = time.time()
+        close = lib.get_pair_data(pair, db, as_array=True)['close']
+        if len(close) < max(block, warmup) + 2:
+            lib.log(log_file, f'Monte Carlo {pair}: not enough candles', pair=pair,
+                    stage='montecarlo')
+            continue
+
+        stats = run_pair(pair, close, strategies, n_paths, horizon, block, warmup, chunk, seed)
+        stats.insert(0, 'run_id', run_id)
+        with con:
+            con.execute('create table if not exists {0} ({1}, primary key (run_id, pair, strategy))'
+                        .format(stats_tbl, ', '.join(stats.columns)))
+            con.execute('delete from {0} where run_id=? and pair=?'.format(stats_tbl),
+                        (run_id, pair))
+            con.executemany(
+                'insert into {0} ({1}) values ({2})'.format(
+                    stats_tbl, ', '.join(stats.columns), ', '.join('?' * len(stats.columns))),
+                stats.itertuples(index=False, name=None))
+        reports.append(stats)
+        lib.log(log_file, f'Monte Carlo {pair}: {len(stats)} strategies', pair=pair,
+                stage='montecarlo', latency=round(time.time() - start, 3))
+    con.close()
+
+    return pd.concat(reports, ignore_index=True) if reports else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='config.ini', help='configuration file')
+    parser.add_argument('--run-id', help='run name (default: today)')
+    parser.add_argument('--paths', type=int, help='resampled paths per pair')
+    parser.add_argument('--seed', type=int, help='random seed')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    stats = run(config.get('db', 'db_name'),
+                run_id=args.run_id,
+                n_paths=args.paths or config.getint('montecarlo', 'paths', fallback=2000),
+                horizon=config.getint('montecarlo', 'horizon', fallback=1095),
+                block=config.getint('montecarlo', 'block', fallback=30),
+                warmup=config.getint('montecarlo', 'warmup', fallback=150),
+                chunk=config.getint('montecarlo', 'chunk', fallback=250),
+                seed=config.getint('montecarlo', 'seed', fallback=0) if args.seed is None else args.seed)
+    if len(stats):
+        print(stats[['pair', 'strategy', 'pnl_p5', 'pnl_p50', 'pnl_p95', 'loss_prob',
+                     'dd_p50', 'dd_p95', 'hist_pnl']].to_string(index=False))
@@ -0,0 +1,322 @@
+###########################################################################################################################################
+# WALK-FORWARD OPTIMIZER
+###########################################################################################################################################
+
+import argparse
+import configparser
+import datetime as dt
+import multiprocessing as mp
+import time
+from sqlite3 import connect
+
+import numpy as np
+import pandas as pd
+
+import indicators as ind
+import utils as lib
+
+proposal_tbl = 'master_proposals'
+checkpoint_tbl = 'optimize_checkpoint'
+
+
+def grid_simulate(close, ema, cut_loss, start=0, end=None, fee=0.002, budget=100):
+    """
+    Info:   utils.simulate for a whole grid of strategies at once
+    Path:   NA
+    Input:  close    - ndarray = close prices (time), or one column per strategy (time x strategy)
+                                 for different price paths without missing candles
+            ema      - ndarray = EMA of close per strategy (time x strategy)
+            cut_loss - ndarray = cut loss per strategy
+            start    - int     = first candle traded, the EMA before it only warms up
+            end      - int     = candle after the last one traded, all if None
+            fee      - float   = commission rate
+            budget   - float   = starting balance of each strategy
+    Output: A list             = [final value per strategy; max drawdown per strategy (fraction);
+                                  number of round trips per strategy]
+    Note:   Same rules and order as utils.simulate: BUY on a cross up, then cut loss on the
+            buy price, then SELL on a cross down, each strategy starting flat at start
+    """
+
+    end = len(close) if end is None else end
+    n = ema.shape[1]
+    bud = np.full(n, float(budget))
+    tokens = np.zeros(n)
+    b_price = np.zeros(n)
+    l_price = 0.0
+    l_ema = np.full(n, np.nan)
+    peak = np.full(n, float(budget))
+    max_dd = np.zeros(n)
+    trips = np.zeros(n, dtype=int)
+
+    with np.errstate(invalid='ignore'):
+        for t in range(start, end):
+            c = close[t]
+            e = ema[t]
+            if np.isnan(c).all():
+                continue
+
+            buy = (c > e) & (l_price < l_ema) & (bud != 0)
+            tokens = np.where(buy, bud / c * (1 - fee), tokens)
+            b_price = np.where(buy, c, b_price)
+            bud = np.where(buy, 0.0, bud)
+
+            sell = (tokens != 0) & (c < b_price * (1 - cut_loss))
+            sell |= (tokens != 0) & (c < e) & (l_price > l_ema)
+            bud = np.where(sell, tokens * c * (1 - fee), bud)
+            tokens = np.where(sell, 0.0, tokens)
+            trips += sell
+
+            l_price = c
+            l_ema = e
+
+            value = np.where(tokens == 0, bud, tokens * c)
+            peak = np.maximum(peak, value)
+            max_dd = np.maximum(max_dd, 1 - value / peak)
+
+    result = np.where(tokens == 0, bud, tokens * close[end - 1]) if end > start else bud
+    return [result, max_dd, trips]
+
+
+def grid_ema(pair, timestamp, close, spans):
+    """
+    Info:   EMA of a pair for every span of the grid (time x span), through the indicator cache
+    Path:   NA
+    """
+
+    return np.column_stack([
+        ind.cache.compute(pair, 'ema', (int(s), ), timestamp[0], timestamp[-1], ind.ema, close)
+        for s in spans
+    ])
+
+
+def walk_forward(pair, timestamp, close, spans, cut_losses, train, test, current=(), top=1):
+    """
+    Info:   Walk-forward optimization of one pair
+    Path:   NA
+    Input:  pair       - string  = pair name
+            timestamp  - ndarray = candle open times (epoch ms)
+            close      - ndarray = close prices
+            spans      - list    = ema spans of the grid
+            cut_losses - list    = cut losses of the grid
+            train      - int     = candles per training window
+            test       - int     = candles per test window, windows roll by test
+            current    - list    = (ema, cut_loss) of the pair in master_tbl
+            top        - int     = parameter sets proposed
+    Output: list                 = one dict per proposed set (rank 1..top) and per current
+                                   set (rank 0, is_current 1) with the same stats
+    Note:   In every window the best grid point on the training candles is traded on the
+            following test candles. Chaining the test results gives the out-of-sample
+            return of the selection rule. The proposal is the best of the last training window.
+            The current sets are extra columns traded on the same windows as they are, in
+            the grid or not, so they can be compared with the proposals.
+    """
+
+    spans, cut_losses = np.asarray(spans), np.asarray(cut_losses, dtype='float64')
+    cur = list(dict.fromkeys((int(e), float(c)) for e, c in current))
+    all_spans = list(dict.fromkeys([int(s) for s in spans] + [e for e, c in cur]))
+    emas = grid_ema(pair, timestamp, close, all_spans)
+
+    s_idx, c_idx = np.meshgrid(np.arange(len(spans)), np.arange(len(cut_losses)), indexing='ij')
+    s_idx, c_idx = s_idx.ravel(), c_idx.ravel()
+    ema, cut = emas[:, s_idx], cut_losses[c_idx]
+    cur_ema = emas[:, [all_spans.index(e) for e, c in cur]]
+    cur_cut = np.array([c for e, c in cur], dtype='float64')
+
+    oos, windows = [], 0
+    for start in range(0, len(close) - train - test + 1, test):
+        train_res, _, _ = grid_simulate(close, ema, cut, start, start + train)
+        best = int(np.argmax(train_res))
+        test_res, _, _ = grid_simulate(close, np.column_stack([ema[:, best], cur_ema]),
+                                       np.concatenate([[cut[best]], cur_cut]),
+                                       start + train, start + train + test)
+        oos.append(test_res / 100)
+        windows += 1
+
+    def oos_stats(returns):
+        if not windows:
+            return {'oos_return': None, 'oos_win_rate': None, 'oos_max_dd': None}
+        curve = np.cumprod(returns)
+        return {'oos_return': float(curve[-1] - 1),
+                'oos_win_rate': float((returns > 1).mean()),
+                'oos_max_dd': float((1 - curve / np.maximum.accumulate(curve)).max())}
+
+    # Final proposal: the last training window
+    last = max(len(close) - train, 0)
+    train_res, train_dd, trips = grid_simulate(close, ema, cut, last)
+    cur_res, cur_dd, cur_trips = grid_simulate(close, cur_ema, cur_cut, last)
+    ranked = np.argsort(-train_res, kind='stable')[:top]
+
+    oos = np.array(oos).reshape(windows, 1 + len(cur))
+    rows = []
+    for rank, g in enumerate(ranked):
+        rows.append({
+            'pair': pair,
+            'rank': rank + 1,
+            'is_current': 0,
+            'ema': int(spans[s_idx[g]]),
+            'cut_loss': float(cut[g]),
+            'train_return': float(train_res[g] / 100 - 1),
+            'train_max_dd': float(train_dd[g]),
+            'train_trips': int(trips[g]),
+            'oos_windows': windows,
+            **oos_stats(oos[:, 0])
+        })
+    for i, (e, c) in enumerate(cur):
+        rows.append({
+            'pair': pair,
+            'rank': 0,
+            'is_current': 1,
+            'ema': e,
+            'cut_loss': c,
+            'train_return': float(cur_res[i] / 100 - 1),
+            'train_max_dd': float(cur_dd[i]),
+            'train_trips': int(cur_trips[i]),
+            'oos_windows': windows,
+            **oos_stats(oos[:, 1 + i])
+        })
+
+    return rows
+
+
+def optimize_pair(db, pair, spans, cut_losses, train, test, current, top):
+    """
+    Info:   Worker: load a pair and run walk_forward on it
+    Path:   NA
+    Output: tuple = (pair, proposals, seconds)
+    """
+
+    start = time.time()
+    data = lib.get_pair_data(pair, db, as_array=True)
+    proposals = walk_forward(pair, data['timestamp'], data['close'], spans, cut_losses,
+                             train, test, current, top) if len(data) > train else []
+    return pair, proposals, round(time.time() - start, 3)
+
+
+def ini_optimize_tbl(con):
+    """
+    Info:   Create the staging and checkpoint tables if they do not exist
+    Path:   NA
+    Input:  con - connection = SQLite connection
+    Output: master_proposals    = proposed master_tbl rows (rank 1..) next to the current ones
+                                  (rank 0, is_current 1) with out-of-sample stats, for review
+            optimize_checkpoint = pairs finished per run, a rerun of the run resumes after them
+    Note:   A staging table of the older layout (current_* columns) is dropped with the
+            checkpoints, so every pair is run again in the new layout
+    """
+
+    columns = [r[1] for r in con.execute('pragma table_info({0})'.format(proposal_tbl))]
+    if columns and 'is_current' not in columns:
+        con.execute('drop table {0}'.format(proposal_tbl))
+        con.execute('drop table if exists {0}'.format(checkpoint_tbl))
+
+    con.execute("""create table if not exists {0} (
+                       run_id              text not null,
+                       pair                text not null,
+                       rank                integer not null,
+                       is_current          integer not null default 0,
+                       ema                 integer not null,
+                       cut_loss            real not null,
+                       train_return        real,
+                       train_max_dd        real,
+                       train_trips         integer,
+                       oos_windows         integer,
+                       oos_return          real,
+                       oos_win_rate        real,
+                       oos_max_dd          real,
+                       primary key (run_id, pair, rank, ema, cut_loss))""".format(proposal_tbl))
+    con.execute("""create table if not exists {0} (
+                       run_id      text not null,
+                       pair        text not null,
+                       seconds     real,
+                       updated_at  text,
+                       primary key (run_id, pair))""".format(checkpoint_tbl))
+
+
+def run(db, master_tbl='master_tbl', run_id=None, spans=(10, 20, 50, 100), cut_losses=(0.05, 0.1),
+        train=540, test=90, workers=2, budget=6 * 3600, log_file='log_master_code.log'):
+    """
+    Info:   Walk-forward optimization of every master_tbl pair, resumable and time boxed
+    Path:   NA
+    Input:  db         - string = database name
+            master_tbl - string = master table name
+            run_id     - string = run name, today (YYYYMMDD) if None, reusing it resumes the run
+            spans      - list   = ema spans of the grid
+            cut_losses - list   = cut losses of the grid
+            train      - int    = candles per training window
+            test       - int    = candles per test window
+            workers    - int    = processes, one pair at a time each
+            budget     - float  = seconds, no new pair is started after it
+            log_file   - string = log file name
+    Output: int                 = pairs finished in this call, proposals in master_proposals
+    Note:   master_tbl is not changed. Every pair's proposals are committed with its
+            checkpoint row by this process alone.
+    """
+
+    run_id = run_id or dt.datetime.utcnow().strftime('%Y%m%d')
+    deadline = time.time() + budget
+
+    con = connect(db)
+    ini_optimize_tbl(con)
+    con.commit()
+    df_master = lib.get_master_data(db, master_tbl)
+    done = {r[0] for r in con.execute(
+        'select pair from {0} where run_id=?'.format(checkpoint_tbl), (run_id, ))}
+
+    tasks = [(db, pair, list(spans), list(cut_losses), train, test,
+              list(zip(rows['ema'], rows['cut_loss'])), len(rows))
+             for pair, rows in df_master.groupby('pair', sort=True) if pair not in done]
+
+    finished = 0
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(max(1, workers), maxtasksperchild=1) as pool:
+        pending = [pool.apply_async(optimize_pair, task) for task in tasks[:workers]]
+        queued = tasks[workers:]
+        while pending:
+            result = pending.pop(0).get()
+            pair, proposals, seconds = result
+            with con:
+                con.execute('delete from {0} where run_id=? and pair=?'.format(proposal_tbl),
+                            (run_id, pair))
+                for p in proposals:
+                    con.execute(
+                        'insert into {0} (run_id, {1}) values (?, {2})'.format(
+                            proposal_tbl, ', '.join(p), ', '.join('?' * len(p))),
+                        [run_id] + list(p.values()))
+                con.execute('insert or replace into {0} values (?, ?, ?, ?)'.format(checkpoint_tbl),
+                            (run_id, pair, seconds, str(dt.datetime.utcnow())))
+            finished += 1
+            n = sum(not p['is_current'] for p in proposals)
+            lib.log(log_file, f'Optimized {pair}: {n} proposals', pair=pair,
+                    stage='optimize', latency=seconds)
+
+            if queued and time.time() < deadline:
+                pending.append(pool.apply_async(optimize_pair, queued.pop(0)))
+
+    con.close()
+    if queued:
+        lib.log(log_file, f'Optimize {run_id}: budget reached, {len(queued)} pairs left',
+                stage='optimize')
+
+    return finished
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='config.ini', help='configuration file')
+    parser.add_argument('--run-id', help='run to start or resume (default: today)')
+    parser.add_argument('--budget', type=float, help='seconds before no new pair is started')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    split = lambda key, default, cast: [cast(v) for v in config.get(
+        'optimize', key, fallback=default).split(',') if v.strip()]
+
+    run(config.get('db', 'db_name'),
+        run_id=args.run_id,
+        spans=split('emas', '10,20,50,100', int),
+        cut_losses=split('cut_losses', '0.05,0.1', float),
+        train=config.getint('optimize', 'train', fallback=540),
+        test=config.getint('optimize', 'test', fallback=90),
+        workers=config.getint('optimize', 'workers', fallback=2),
+        budget=args.budget or config.getfloat('optimize', 'budget', fallback=6 * 3600))
@@ -0,0 +1,191 @@
+###########################################################################################################################################
+# PIPELINED SESSION
+###########################################################################################################################################
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlite3 import connect
+
+import pandas as pd
+
+import utils as lib
+
+
+def fetch_pair(bnc, db, pair, latest_ts, deadline, interval='8h', poll=2.0):
+    """
+    Info:   Fetch one pair until its latest candle is stored
+    Path:   NA
+    Input:  bnc       - Binance = exchange endpoint
+            db        - string  = database name
+            pair      - string  = pair name
+            latest_ts - int     = open time of the session candle (epoch ms)
+            deadline  - float   = time.time() to give up at
+            interval  - string  = kline interval
+            poll      - float   = seconds between fetches of a pair not closed yet
+    Output: bool                = True if the candle is in
+    Note:   Single attempts of Binance.fetch_bnc_data, a failed request is retried
+            like a candle not closed yet and never past the deadline
+    """
+
+    while True:
+        try:
+            bnc.fetch_bnc_data(db, pair, None, interval)
+        except Exception as e:
+            lib.log('log_master_code.log', f'{pair} {e}', pair=pair, stage='get_data')
+        last_ts = lib.get_watermark(db, pair, interval)
+        if last_ts is not False and last_ts >= latest_ts:
+            return True
+        if time.time() + poll > deadline:
+            return False
+        time.sleep(poll)
+
+
+def run_session(bnc, db, pair_list, txn_time, master_tbl='master_tbl', signal_tbl='signal_tbl',
+                txn_tbl='txn_tbl', map_tbl='master_tbl', buy_deadline=120, timeout=900,
+                workers=8, net=False, log_file='log_master_code.log'):
+    """
+    Info:   Fetch, generate signals and trade each pair as soon as its own candle is in
+    Path:   NA
+    Input:  bnc          - Binance  = exchange endpoint
+            db           - string   = database name
+            pair_list    - list     = pairs of the portfolio
+            txn_time     - datetime = session timestamp
+            master_tbl   - string   = master table name
+            signal_tbl   - string   = signal table name
+            txn_tbl      - string   = transaction table name
+            map_tbl      - string   = map table name
+            buy_deadline - float    = seconds to wait for every pair before sizing BUYs
+            timeout      - float    = seconds after which pairs still missing are given up
+            workers      - int      = pairs fetched at the same time
+            net          - bool     = one net order per pair, as gen_txn(net=True)
+            log_file     - string   = log file name
+    Output: dict                    = num_of_complete, missing pairs, seconds and seconds to the first order
+    Note:   Pairs are fetched in a thread pool. Signals and orders run on this thread as
+            pairs complete: SELLs go out right away. BUY sizing needs the USDT freed by
+            every SELL, so BUYs wait until all pairs are in or buy_deadline passes. The
+            amount per BUY is then fixed and pairs completing later buy with it right away.
+            Their SELLs after the deadline only add USDT for the next session.
+            Pairs still missing after timeout are given up, even if a request hangs.
+            With net, a pair with BUYs is netted and sent as a whole once sized, its SELLs
+            count towards the sizing at the ticker price as in gen_netted_txn.
+    """
+
+    start = time.time()
+    latest_ts = lib.to_ms(txn_time)
+
+    # Same signal window for every pair as a gen_ema_signal run over the whole master table
+    df_master = lib.get_master_data(db, master_tbl)
+    start_date = lib.dt.datetime.today() - lib.dt.timedelta(
+        days=int(df_master['ema'].iat[0]) * 3) if len(df_master) else None
+
+    hold_list = bnc.get_hold_list(db, txn_tbl)
+    n_sell = 0
+    sized = False
+    txn_amt = None
+    pending_buys = []
+    pending_net = []
+    first_order = None
+    done, missing = [], []
+
+    def read_signals(pair):
+        if not lib.is_tbl_exist(signal_tbl, db):
+            return pd.DataFrame(columns=['timestamp', 'pair', 'strategy', 'action',
+                                         'buy_price', 'sell_price'])
+        return pd.read_sql(
+            """select * from {0} where timestamp = '{1}' and pair = ?""".format(
+                signal_tbl, txn_time), connect(db), params=(pair, ))
+
+    def buy(buy_list):
+        nonlocal first_order, txn_amt
+        if len(buy_list) != 0:
+            if txn_amt is None:
+                txn_amt = bnc.get_txn_amt(db, master_tbl, len(hold_list), n_sell)
+            bnc.execute_buys(db, txn_tbl, txn_time, buy_list, txn_amt)
+            first_order = first_order or time.time()
+
+    def net_order(pair, sells, buys):
+        nonlocal first_order, txn_amt
+        if len(buys) != 0 and txn_amt is None:
+            txn_amt = bnc.get_txn_amt(db, master_tbl, len(hold_list), n_sell)
+        bnc.execute_net_order(db, txn_tbl, map_tbl, txn_time, pair, sells, buys, txn_amt or 0)
+        first_order = first_order or time.time()
+
+    pool = ThreadPoolExecutor(workers)
+    futures = {
+        pool.submit(fetch_pair, bnc, db, pair, latest_ts, start + timeout): pair
+        for pair in pair_list
+    }
+
+    while futures:
+        ready, _ = wait(list(futures), timeout=1, return_when=FIRST_COMPLETED)
+        if not ready and time.time() - start > timeout + 10:
+            lib.log(log_file, f'Pipeline: giving up {sorted(futures.values())}', stage='get_data')
+            missing += sorted(futures.values())
+            futures.clear()
+        for future in ready:
+            pair = futures.pop(future)
+            try:
+                complete = future.result()
+            except Exception as e:
+                lib.log(log_file, f'Pipeline {pair} - {e}', pair=pair, stage='get_data')
+                complete = False
+            if not complete:
+                missing.append(pair)
+                continue
+            done.append(pair)
+
+            lib.gen_ema_signal(db, master_tbl, start_date, pair_list=[pair])
+            bnc.signal_ms = bnc.clock.now_ms()
+            signals = read_signals(pair)
+
+            if net:
+                sells = bnc.get_net_sell_list(hold_list, signals)
+                buys = signals.loc[signals.action == 'BUY']
+                if not sized:
+                    n_sell += len(sells)
+                if sized or len(buys) == 0:
+                    if len(sells) + len(buys) != 0:
+                        net_order(pair, sells, buys)
+                else:
+                    pending_net.append((bnc.signal_ms, pair, sells, buys))
+                continue
+
+            sell_list = bnc.get_sell_list(hold_list, signals)
+            if len(sell_list) != 0:
+                bnc.execute_sells(db, txn_tbl, map_tbl, txn_time, sell_list)
+                first_order = first_order or time.time()
+                if not sized:
+                    n_sell += len(sell_list)
+
+            buy_list = signals.loc[signals.action == 'BUY']
+            if sized:
+                buy(buy_list)
+            else:
+                pending_buys.append((bnc.signal_ms, buy_list))
+
+        if not sized and (not futures or time.time() - start > buy_deadline):
+            if futures:
+                lib.log(log_file, f'Pipeline: sizing BUYs without {sorted(futures.values())}',
+                        stage='gen_txn')
+            sized = True
+            if pending_net:
+                txn_amt = bnc.get_txn_amt(
+                    db, master_tbl, len(hold_list), n_sell,
+                    bnc.get_freed(pd.concat([sells for _, _, sells, _ in pending_net])))
+            # Orders held for sizing keep the signal time of their pair in the ledger
+            for signal_ms, pair, sells, buys in pending_net:
+                bnc.signal_ms = signal_ms
+                net_order(pair, sells, buys)
+            for signal_ms, buy_list in pending_buys:
+                bnc.signal_ms = signal_ms
+                buy(buy_list)
+
+    # A fetch stuck in a request must not hold the session, its thread is left behind
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        'num_of_complete': len(done),
+        'missing': missing,
+        'seconds': round(time.time() - start, 3),
+        'first_order': None if first_order is None else round(first_order - start, 3)
+    }
@@ -0,0 +1,332 @@
+###########################################################################################################################################
+# PRE-CLOSE SIGNALS
+###########################################################################################################################################
+
+import datetime as dt
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlite3 import connect
+
+import numpy as np
+import pandas as pd
+
+import indicators as ind
+import utils as lib
+
+threshold_tbl = 'preclose_thresholds'
+run_tbl = 'preclose_runs'
+pair_tbl = 'preclose_pairs'
+
+
+def ini_preclose_tbl(con):
+    """
+    Info:   Create the pre-close tables if they do not exist
+    Path:   NA
+    Input:  con - connection = SQLite connection
+    Output: preclose_thresholds = close prices that flip each strategy on the forming candle
+            preclose_runs       = one row per session traded at candle close
+            preclose_pairs      = pairs evaluated and traded at candle close per session
+    """
+
+    con.execute("""create table if not exists {0} (
+                       timestamp   text not null,
+                       pair        text not null,
+                       strategy    text not null,
+                       held        integer not null,
+                       b_price     real,
+                       buy_above   real,
+                       sell_below  real,
+                       cut_below   real,
+                       primary key (timestamp, pair, strategy))""".format(threshold_tbl))
+    con.execute("""create table if not exists {0} (
+                       timestamp   text primary key,
+                       close_ms    integer,
+                       signal_ms   integer,
+                       traded_ms   integer,
+                       signals     integer)""".format(run_tbl))
+    con.execute("""create table if not exists {0} (
+                       timestamp   text not null,
+                       pair        text not null,
+                       primary key (timestamp, pair))""".format(pair_tbl))
+
+
+def strategy_state(pair, data, ema, cut_loss):
+    """
+    Info:   State of a strategy after the last closed candle, as gen_ema_signal simulates it
+    Path:   NA
+    Input:  pair     - string  = pair name
+            data     - ndarray = structured array of timestamp (epoch ms) and close
+            ema      - int     = ema span
+            cut_loss - float   = cut loss percentage
+    Output: dict               = held, b_price (buy price of the open position), l_price, l_ema
+    """
+
+    df = pd.DataFrame({'timestamp': lib.from_ms(data['timestamp']), 'close': data['close']})
+    ema_values = ind.cache.compute(pair, 'ema', (int(ema), ), df.timestamp.iat[0],
+                                   df.timestamp.iat[-1], ind.ema, data['close'])
+    trades = lib.simulate(df, ema, cut_loss, ema_values)[1]
+
+    held = trades is not None and trades['action'].iat[-1] == 'BUY'
+    return {
+        'held': held,
+        'b_price': trades['buy_price'].iat[-1] if held else np.nan,
+        'l_price': data['close'][-1],
+        'l_ema': ema_values[-1]
+    }
+
+
+def compute_thresholds(db, master_tbl, txn_time, interval='8h', pair_list=None):
+    """
+    Info:   Precompute the close prices that would flip a BUY/SELL/CUT_SELL on the forming candle
+    Path:   NA
+    Input:  db         - string   = database name
+            master_tbl - string   = master table name
+            txn_time   - datetime = open time of the forming candle (UTC+7, as in signal_tbl)
+            interval   - string   = kline interval
+            pair_list  - list     = only these pairs, all pairs if None
+    Output: dataframe             = timestamp, pair, strategy, held, b_price, buy_above,
+                                    sell_below, cut_below, also written to preclose_thresholds
+    Note:   With alpha = 2 / (span + 1), ema_t = ema_t-1 + alpha * (close - ema_t-1), so
+            close > ema_t exactly when close > ema_t-1: the EMA cross is decided by the
+            EMA of the last closed candle. Following utils.simulate:
+              no position: BUY      if l_price < l_ema and close > l_ema
+              position:    CUT_SELL if close < b_price * (1 - cut_loss)
+                           SELL     if l_price > l_ema and close < l_ema
+            Pairs whose last stored candle is not the one before txn_time are left out.
+    """
+
+    df_master = lib.get_master_data(db, master_tbl)
+    if pair_list is not None:
+        df_master = df_master.loc[df_master.pair.isin(pair_list)]
+    if len(df_master) == 0:
+        return pd.DataFrame()
+
+    # Same window as gen_ema_signal, so the thresholds reproduce its signals
+    start_date = lib.dt.datetime.today() - lib.dt.timedelta(days=int(df_master['ema'].iat[0]) * 3)
+    prev_ms = lib.to_ms(txn_time) - lib.interval_ms[interval]
+
+    rows = []
+    for pair, strategies in df_master.groupby('pair', sort=False):
+        data = lib.get_pair_data(pair, db, start_date=start_date, as_array=True)
+        if len(data) == 0 or data['timestamp'][-1] != prev_ms:
+            lib.log('log_master_code.log', f'Pre-close {pair}: last candle missing',
+                    pair=pair, stage='preclose')
+            continue
+
+        for ema, cut_loss in zip(strategies['ema'], strategies['cut_loss']):
+            state = strategy_state(pair, data, ema, cut_loss)
+            rows.append({
+                'timestamp': str(pd.Timestamp(txn_time)),
+                'pair': pair,
+                'strategy': str(ema) + str(cut_loss),
+                'held': int(state['held']),
+                'b_price': state['b_price'],
+                'buy_above': state['l_ema'] if not state['held'] and state['l_price'] < state['l_ema'] else np.nan,
+                'sell_below': state['l_ema'] if state['held'] and state['l_price'] > state['l_ema'] else np.nan,
+                'cut_below': state['b_price'] * (1 - cut_loss) if state['held'] else np.nan
+            })
+
+    thresholds = pd.DataFrame(rows)
+
+    con = connect(db)
+    with con:
+        ini_preclose_tbl(con)
+        con.execute('delete from {0} where timestamp=?'.format(threshold_tbl),
+                    (str(pd.Timestamp(txn_time)), ))
+        if len(thresholds) != 0:
+            thresholds.to_sql(threshold_tbl, con, if_exists='append', index=False)
+    con.close()
+
+    return thresholds
+
+
+def evaluate(thresholds, close):
+    """
+    Info:   Turn final close prices into signals with one comparison per strategy
+    Path:   NA
+    Input:  thresholds - dataframe = rows of compute_thresholds
+            close      - dict      = {pair: close price of the candle}
+    Output: dataframe              = signals in signal_tbl columns
+                                     (timestamp, pair, strategy, action, buy_price, sell_price)
+    """
+
+    price = thresholds['pair'].map(close).to_numpy(dtype='float64')
+    held = thresholds['held'].to_numpy(dtype=bool)
+
+    with np.errstate(invalid='ignore'):
+        cut = held & (price < thresholds['cut_below'].to_numpy())
+        sell = held & ~cut & (price < thresholds['sell_below'].to_numpy())
+        buy = ~held & (price > thresholds['buy_above'].to_numpy())
+
+    action = np.select([cut, sell, buy], ['CUT_SELL', 'SELL', 'BUY'], '')
+    fired = action != ''
+
+    signals = thresholds.loc[fired, ['timestamp', 'pair', 'strategy']].copy()
+    signals['action'] = action[fired]
+    signals['buy_price'] = np.where(buy[fired], price[fired], thresholds['b_price'].to_numpy()[fired])
+    signals['sell_price'] = np.where(buy[fired], None, price[fired])
+
+    return signals.reset_index(drop=True)
+
+
+def fetch_closes(bnc, db, pair_list, open_ms, interval='8h', workers=8, timeout=60):
+    """
+    Info:   Get the final candle of every pair right after it closes
+    Path:   NA
+    Input:  bnc       - Binance = exchange endpoint
+            db        - string  = database name
+            pair_list - list    = pairs to be fetched
+            open_ms   - int     = open time of the candle (epoch ms)
+            interval  - string  = kline interval
+            workers   - int     = concurrent requests
+            timeout   - float   = seconds to keep asking for a candle not closed yet
+    Output: dict                = {pair: close price}, the candles are stored in the pair tables
+    """
+
+    def fetch(pair):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            klines = bnc.client.get_klines(symbol=pair, interval=interval,
+                                           startTime=open_ms, limit=1)
+            data = lib.kline_frame(klines)
+            data = data.loc[(data.timestamp == open_ms) & (data.close_time < bnc.clock.now_ms())]
+            if len(data) != 0:
+                return pair, data
+            time.sleep(0.2)
+        return pair, None
+
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(fetch, pair_list))
+
+    closes = {}
+    con = connect(db)
+    for pair, data in results:
+        if data is not None:
+            lib.write_klines(con, db, pair, data, interval)
+            closes[pair] = data['close'].iat[0]
+    con.close()
+
+    return closes
+
+
+def is_traded(db, txn_time):
+    """
+    Info:   Check if a session was already traded at candle close
+    Path:   NA
+    Input:  db       - string   = database name
+            txn_time - datetime = session timestamp
+    Output: bool
+    """
+
+    if not lib.is_tbl_exist(run_tbl, db):
+        return False
+    con = connect(db)
+    row = con.execute('select traded_ms from {0} where timestamp=?'.format(run_tbl),
+                      (str(pd.Timestamp(txn_time)), )).fetchone()
+    con.close()
+    return row is not None and row[0] is not None
+
+
+def traded_pairs(db, txn_time):
+    """
+    Info:   Get the pairs a session traded at candle close
+    Path:   NA
+    Input:  db       - string   = database name
+            txn_time - datetime = session timestamp
+    Output: list                = pairs evaluated at candle close, empty if the session was not
+    """
+
+    if not is_traded(db, txn_time) or not lib.is_tbl_exist(pair_tbl, db):
+        return []
+    con = connect(db)
+    pairs = [r[0] for r in con.execute('select pair from {0} where timestamp=?'.format(pair_tbl),
+                                       (str(pd.Timestamp(txn_time)), ))]
+    con.close()
+    return pairs
+
+
+def run(config_file='config.ini', section='binance', mock=False):
+    """
+    Info:   Pre-close mode: precompute thresholds on the forming candle, trade at its close
+    Path:   NA
+    Input:  config_file - string = configuration file
+            section     - string = portfolio config section
+            mock        - bool   = use the mock exchange
+    Output: NA, signals of the closed candle are written and gen_txn is run right away
+    Note:   Started some minutes before the candle closes. The pairs evaluated here are
+            recorded, the later regular run finds their signals behind the watermarks and
+            runs gen_txn for the other pairs only (last candle or close missing here).
+            Without any signal nothing is traded here and the run is recorded with no
+            traded_ms, so the regular run trades the whole session. Errors are logged and
+            mailed like in main.
+    """
+
+    from main import read_config, get_binance, get_db
+    import shard
+
+    config = read_config(config_file)
+    db = get_db(config, section)
+    log_file = 'log_master_code.log'
+    master_tbl = map_tbl = 'master_tbl'
+    signal_tbl = 'signal_tbl'
+    txn_tbl = 'txn_tbl'
+    interval = config.get('preclose', 'interval', fallback='8h')
+    step = lib.interval_ms[interval]
+
+    txn_time = 'PRECLOSE'
+
+    try:
+        bnc = get_binance(config, section, mock)
+        pair_list = pd.read_sql(f'select distinct pair from {master_tbl}',
+                                connect(db))['pair'].to_list()
+
+        open_ms = bnc.clock.now_ms() // step * step
+        txn_time = lib.from_ms(open_ms)
+        if is_traded(db, txn_time):
+            return
+
+        # Candles up to the one before the forming candle
+        bnc.get_data(db=db, pair_list=pair_list, interval=interval)
+        thresholds = compute_thresholds(db, master_tbl, txn_time, interval)
+        lib.log(log_file, f'Pre-close thresholds: {len(thresholds)}', stage='preclose',
+                txn_time=txn_time)
+
+        # Wait for the close on the exchange clock
+        while bnc.clock.now_ms() < open_ms + step:
+            time.sleep(min(1.0, max(0.0, (open_ms + step - bnc.clock.now_ms()) / 1000)))
+        close_ms = bnc.clock.now_ms()
+
+        closes = fetch_closes(bnc, db, thresholds['pair'].unique().tolist() if len(thresholds) else [],
+                              open_ms, interval,
+                              workers=config.getint('preclose', 'workers', fallback=8),
+                              timeout=config.getfloat('preclose', 'timeout', fallback=60))
+        signals = evaluate(thresholds.loc[thresholds.pair.isin(list(closes))], closes) \
+            if len(thresholds) else pd.DataFrame()
+        # Nothing to trade at close (no stored previous candle, no close or no cross)
+        if len(signals) != 0:
+            shard.import_signals(db, signals.astype({'timestamp': str}).to_dict('records'))
+        signal_ms = bnc.signal_ms = bnc.clock.now_ms()
+
+        traded_ms = None
+        if len(signals) != 0:
+            bnc.gen_txn(db, master_tbl, signal_tbl, txn_tbl, map_tbl, txn_time,
+                        net=config.getboolean('txn', 'netting', fallback=False))
+            traded_ms = bnc.clock.now_ms()
+
+        con = connect(db)
+        with con:
+            ini_preclose_tbl(con)
+            con.execute('insert or replace into {0} values (?, ?, ?, ?, ?)'.format(run_tbl),
+                        (str(txn_time), close_ms, signal_ms, traded_ms, len(signals)))
+            if traded_ms is not None:
+                con.executemany('insert or replace into {0} values (?, ?)'.format(pair_tbl),
+                                [(str(txn_time), pair) for pair in closes])
+        con.close()
+
+        lib.log(log_file, f'Pre-close: {len(signals)} signals, {len(closes)}/{len(pair_list)} closes',
+                stage='preclose', signal_latency_ms=signal_ms - (open_ms + step),
+                order_latency_ms=None if traded_ms is None else traded_ms - (open_ms + step))
+    except Exception as err:
+        with open(log_file, 'a+') as f:
+            f.write(f'{dt.datetime.utcnow()} - {err}\n')
+        lib.send_err(str(err), txn_time)
@@ -0,0 +1,207 @@
+###########################################################################################################################################
+# STAGE PROFILER
+###########################################################################################################################################
+
+import cProfile
+import contextlib
+import datetime as dt
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+stage_names = ('get_data', 'check_completeness', 'gen_ema_signal', 'gen_txn', 'gen_mail')
+
+
+class Sampler:
+    """
+    Info:   Low overhead sampling profiler of one thread
+    Path:   NA
+    Note:   A daemon thread reads the stack of the target thread every interval seconds,
+            stacks are counted in the folded format of flamegraph.pl / speedscope
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{0} ({1}:{2})'.format(code.co_name,
+                                                    os.path.basename(code.co_filename),
+                                                    code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path):
+        """
+        Info:   Write folded stacks, one 'frame;frame;frame count' line per distinct stack
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{0} {1}\n'.format(stack, count))
+
+
+def folded_from_cprofile(prof):
+    """
+    Info:   Folded caller;callee edges of a cProfile run, for a flamegraph of the call graph
+    Path:   NA
+    Input:  prof - Profile = finished cProfile profile
+    Output: list           = 'caller;callee microseconds' lines
+    Note:   cProfile keeps one level of callers only, deeper stacks are not rebuilt
+    """
+
+    name = lambda f: '{0} ({1}:{2})'.format(f[2], os.path.basename(f[0]), f[1])
+    lines = []
+    for func, (cc, nc, tt, ct, callers) in pstats.Stats(prof).stats.items():
+        if not callers:
+            lines.append('{0} {1}'.format(name(func), int(tt * 1e6)))
+        for caller, (_, _, c_tt, _) in callers.items():
+            lines.append('{0};{1} {2}'.format(name(caller), name(func), int(c_tt * 1e6)))
+    return [l for l in lines if not l.endswith(' 0')]
+
+
+class StageProfiler:
+    """
+    Info:   Profile chosen pipeline stages and keep the reports next to the logs
+    Path:   path
+    Note:   Per profiled stage and run, files named <stage>_<YYYYmmddHHMMSS>:
+              .folded    - stacks for flamegraph.pl / speedscope
+              .prof      - pstats dump (cprofile mode)
+              _alloc.txt - top allocation sites and peak traced memory (memory on)
+    """
+
+    def __init__(self, stages=(), mode='sample', path='profiles', interval=0.005,
+                 top_n=25, memory=True):
+        """
+        Input:  stages   - iterable = stage names to profile, nothing is profiled if empty
+                mode     - string   = 'sample' (low overhead) or 'cprofile' (deterministic)
+                path     - string   = directory of the reports
+                interval - float    = seconds between samples
+                top_n    - int      = allocation sites in the memory report
+                memory   - bool     = trace allocations with tracemalloc
+        """
+        self.stages = set(stages)
+        self.mode = mode
+        self.path = path
+        self.interval = interval
+        self.top_n = top_n
+        self.memory = memory
+        self.reports = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Info:   Profile the enclosed code if the stage is enabled
+        Input:  name - string = stage name
+        """
+
+        if name not in self.stages:
+            yield
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        prefix = os.path.join(self.path,
+                              '{0}_{1:%Y%m%d%H%M%S}'.format(name, dt.datetime.now()))
+        n = 1
+        while os.path.exists(prefix + ('_{0}'.format(n) if n > 1 else '') + '.folded'):
+            n += 1
+        if n > 1:
+            prefix += '_{0}'.format(n)
+
+        own_trace = self.memory and not tracemalloc.is_tracing()
+        if own_trace:
+            tracemalloc.start(25)
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = self._snapshot()
+
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = Sampler(self.interval)
+            profiler.start()
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            if self.mode == 'cprofile':
+                profiler.disable()
+                profiler.dump_stats(prefix + '.prof')
+                with open(prefix + '.folded', 'w') as f:
+                    f.write('\n'.join(folded_from_cprofile(profiler)) + '\n')
+            else:
+                profiler.stop()
+                profiler.write(prefix + '.folded')
+
+            if self.memory:
+                self.write_allocations(prefix + '_alloc.txt', name, elapsed, before)
+                if own_trace:
+                    tracemalloc.stop()
+
+            self.reports.append({'stage': name, 'path': prefix, 'seconds': round(elapsed, 3)})
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, __file__),
+             tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+
+    def write_allocations(self, path, name, elapsed, before):
+        """
+        Info:   Write the traced peak of a stage and the top sites of memory it allocated and kept
+        """
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot()
+
+        out = io.StringIO()
+        out.write('stage={0} seconds={1:.3f} current_kib={2:.1f} peak_kib={3:.1f}\n\n'.format(
+            name, elapsed, current / 1024, peak / 1024))
+        for stat in snapshot.compare_to(before, 'lineno')[:self.top_n]:
+            frame = stat.traceback[0]
+            out.write('{0:>+10.1f} KiB {1:>+8} blocks  {2:>10.1f} KiB held  {3}:{4}\n'.format(
+                stat.size_diff / 1024, stat.count_diff, stat.size / 1024,
+                frame.filename, frame.lineno))
+
+        with open(path, 'w') as f:
+            f.write(out.getvalue())
+
+
+profiler = StageProfiler()
+
+
+def stage(name):
+    """
+    Info:   Profile a stage with the module profiler (configured by main)
+    Path:   NA
+    Input:  name - string = stage name
+    Output: context manager
+    """
+    return profiler.stage(name)
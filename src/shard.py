@@ -0,0 +1,286 @@
+###########################################################################################################################################
+# PAIR SHARDING
+###########################################################################################################################################
+
+import json
+import multiprocessing as mp
+import os
+import time
+import zlib
+from sqlite3 import connect
+
+import pandas as pd
+
+import utils as lib
+
+
+def shard_of(pair, n_shards):
+    """
+    Info:   Get the shard of a pair by hash, stable across processes and hosts
+    Path:   NA
+    Input:  pair     - string = pair name
+            n_shards - int    = number of shards
+    Output: int               = shard index
+    """
+    return zlib.crc32(pair.encode()) % n_shards
+
+
+def parse_groups(text):
+    """
+    Info:   Parse pair groups from config
+    Path:   NA
+    Input:  text - string = 'name: PAIR1, PAIR2; name2: PAIR3'
+    Output: dict          = {name: [pairs]}
+    """
+
+    groups = {}
+    for group in filter(None, (g.strip() for g in (text or '').split(';'))):
+        name, pairs = group.split(':', 1)
+        groups[name.strip()] = [p.strip() for p in pairs.split(',') if p.strip()]
+    return groups
+
+
+def partition(pair_list, n_shards, groups=None):
+    """
+    Info:   Split pairs into shards
+    Path:   NA
+    Input:  pair_list - list = pairs to be split
+            n_shards  - int  = number of shards
+            groups    - dict = {name: [pairs]} kept together, groups are dealt to shards in name order
+    Output: list             = one list of pairs per shard
+    """
+
+    shards = [[] for _ in range(n_shards)]
+    placed = set()
+
+    for i, name in enumerate(sorted(groups or {})):
+        for pair in groups[name]:
+            if pair in pair_list and pair not in placed:
+                shards[i % n_shards].append(pair)
+                placed.add(pair)
+
+    for pair in pair_list:
+        if pair not in placed:
+            shards[shard_of(pair, n_shards)].append(pair)
+
+    return shards
+
+
+def report_path(report_dir, section, txn_time, shard, n_shards):
+    """
+    Info:   Get the report file of a shard for a session
+    Path:   report_dir
+    Output: string = report file path
+    """
+    return os.path.join(
+        report_dir, '{0}_{1:%Y%m%d%H}_{2}of{3}.json'.format(
+            section, pd.Timestamp(txn_time), shard, n_shards))
+
+
+def run_shard(config_file, section, shard, n_shards, report_dir=None, mock=False):
+    """
+    Info:   Worker: fetch data and generate signals of one shard of the pair universe
+    Path:   NA
+    Input:  config_file - string = configuration file
+            section     - string = config section of the portfolio (api keys, db)
+            shard       - int    = shard index
+            n_shards    - int    = number of shards
+            report_dir  - string = directory the report is written to, not written if None
+            mock        - bool   = use the mock exchange
+    Output: dict                 = shard report (pairs, completeness, timings, latest signals)
+    Note:   Orders are not sent by workers, BUY sizing needs the signals of every shard
+    """
+
+    from main import read_config, get_binance, get_db, update_data, configure_profiler
+    import profiling
+
+    config = read_config(config_file)
+    configure_profiler(config)
+    db = get_db(config, section)
+    log_file = 'log_master_code.log'
+    master_tbl = 'master_tbl'
+
+    pair_list = pd.read_sql(f'select distinct pair from {master_tbl}',
+                            connect(db))['pair'].to_list()
+    pair_list = partition(pair_list, n_shards,
+                          parse_groups(config.get('shard', 'groups',
+                                                  fallback='')))[shard]
+    txn_time = lib.get_latest_txn_time()
+    bnc = get_binance(config, section, mock)
+
+    timings = {}
+    start = time.time()
+    num_of_complete = update_data(bnc, db, pair_list, txn_time, log_file,
+                                  retries=config.getint('shard', 'retries',
+                                                        fallback=None),
+                                  repair=config.getboolean('data', 'repair_gaps',
+                                                           fallback=True))
+    timings['get_data'] = round(time.time() - start, 3)
+
+    start = time.time()
+    with profiling.stage('gen_ema_signal'):
+        lib.gen_ema_signal(db, master_tbl, None, pair_list=pair_list)
+    timings['gen_ema_signal'] = round(time.time() - start, 3)
+
+    signals = pd.read_sql(
+        """select timestamp, pair, strategy, action, buy_price, sell_price
+           from signal_tbl where timestamp = '{0}'""".format(txn_time),
+        connect(db))
+    signals = signals.loc[signals.pair.isin(pair_list)]
+
+    report = {
+        'section': section,
+        'txn_time': str(txn_time),
+        'shard': shard,
+        'n_shards': n_shards,
+        'pairs': pair_list,
+        'num_of_complete': num_of_complete,
+        'timings': timings,
+        'signals': signals.astype({'timestamp': str}).to_dict('records')
+    }
+
+    if report_dir is not None:
+        os.makedirs(report_dir, exist_ok=True)
+        path = report_path(report_dir, section, txn_time, shard, n_shards)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(report, f)
+        os.replace(path + '.tmp', path)
+
+    lib.log(log_file, f'Shard {shard}/{n_shards}: {num_of_complete}/{len(pair_list)}',
+            stage='shard', latency=timings['get_data'] + timings['gen_ema_signal'])
+
+    return report
+
+
+def read_reports(report_dir, section, txn_time, shards, n_shards, timeout=600):
+    """
+    Info:   Wait for the reports of remote shards of a session
+    Path:   report_dir
+    Input:  report_dir - string = directory shared with the remote workers
+            section    - string = portfolio config section
+            txn_time   - datetime = session timestamp
+            shards     - list   = shard indexes to wait for
+            n_shards   - int    = number of shards
+            timeout    - float  = seconds to wait before giving up on missing shards
+    Output: list                = reports found
+    """
+
+    paths = {s: report_path(report_dir, section, txn_time, s, n_shards) for s in shards}
+    deadline = time.time() + timeout
+    while time.time() < deadline and not all(os.path.exists(p) for p in paths.values()):
+        time.sleep(1)
+
+    reports = []
+    for shard, path in paths.items():
+        if os.path.exists(path):
+            with open(path) as f:
+                reports.append(json.load(f))
+    return reports
+
+
+def import_signals(db, signals):
+    """
+    Info:   Append signals produced on another host to the local signal_tbl
+    Path:   NA
+    Input:  db      - string = database name
+            signals - list   = signal records from shard reports
+    Output: Data in signal_tbl, records at or before the signal watermark are skipped
+    """
+
+    if len(signals) == 0:
+        return
+
+    con = connect(db)
+    df = pd.DataFrame(signals)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    for (pair, strategy), rows in df.groupby(['pair', 'strategy']):
+        latest_date = lib.get_watermark(db, pair, strategy=strategy)
+        if latest_date is not False:
+            rows = rows.loc[rows.timestamp > latest_date]
+        lib.write_signals(con, db, 'signal_tbl', rows)
+    con.close()
+
+
+def merge_reports(reports):
+    """
+    Info:   Merge shard reports into one session report
+    Path:   NA
+    Input:  reports - list = shard reports
+    Output: dict           = total completeness, timings and signals per shard
+    """
+
+    return {
+        'num_of_complete': sum(r['num_of_complete'] for r in reports),
+        'pairs': sum(len(r['pairs']) for r in reports),
+        'shards': sorted(r['shard'] for r in reports),
+        'timings': {r['shard']: r['timings'] for r in reports},
+        'signals': [s for r in reports for s in r['signals']]
+    }
+
+
+def run_coordinator(config_file, section, db, txn_time, workers, remote_shards=0,
+                    report_dir='reports', timeout=600, mock=False):
+    """
+    Info:   Coordinator: run local shards in worker processes and collect remote shards
+    Path:   NA
+    Input:  config_file   - string   = configuration file
+            section       - string   = portfolio config section
+            db            - string   = database name
+            txn_time      - datetime = session timestamp
+            workers       - int      = number of local worker processes (shards 0..workers-1)
+            remote_shards - int      = number of shards run on other hosts (the following indexes)
+            report_dir    - string   = directory shared with the remote workers
+            timeout       - float    = seconds to wait for remote shards
+            mock          - bool     = use the mock exchange
+    Output: dict                     = merged report, remote signals are imported into db
+    """
+
+    n_shards = workers + remote_shards
+
+    reports = []
+    if workers != 0:
+        with mp.get_context('spawn').Pool(workers) as pool:
+            reports = pool.starmap(
+                run_shard,
+                [(config_file, section, i, n_shards, None, mock)
+                 for i in range(workers)])
+
+    if remote_shards != 0:
+        remote = read_reports(report_dir, section, txn_time,
+                              range(workers, n_shards), n_shards, timeout)
+        import_signals(db, [s for r in remote for s in r['signals']])
+        reports += remote
+
+    # Workers moved the watermarks in their own processes
+    lib.load_watermarks(db, reload=True)
+
+    return merge_reports(reports)
+
+
+def run_portfolios(config_file, mock=False):
+    """
+    Info:   Run every portfolio (config sections named portfolio.<name>) in its own process
+    Path:   NA
+    Input:  config_file - string = configuration file
+            mock        - bool   = use the mock exchange
+    Output: NA, each portfolio trades with its own api keys and database
+    """
+
+    from main import main, read_config
+
+    config = read_config(config_file)
+    ctx = mp.get_context('spawn')
+    processes = [
+        ctx.Process(target=main,
+                    kwargs={
+                        'config_file': config_file,
+                        'section': section,
+                        'mock': mock
+                    },
+                    name=section)
+        for section in config.sections() if section.startswith('portfolio.')
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
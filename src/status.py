@@ -0,0 +1,183 @@
+###########################################################################################################################################
+# STATUS API
+###########################################################################################################################################
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import os
+import tempfile
+import threading
+
+from logger import get_logger
+
+
+class Snapshot:
+    """
+    Info:   In-memory status of the trading run, written to a JSON file after each stage
+    Path:   NA
+    Note:   Sections: positions, signals, timings, fetch. The file is replaced atomically,
+            so the status server never reads a partial snapshot and never opens the database.
+            Each write goes through its own temporary file, so processes sharing a directory
+            do not collide. A failed write is logged and never stops the trading run.
+    """
+
+    def __init__(self, path='status.json', log_file='log_master_code.log'):
+        self.path = path
+        self.log_file = log_file
+        self._lock = threading.Lock()
+        self.data = {
+            'positions': [],
+            'signals': [],
+            'timings': {},
+            'fetch': {},
+            'updated_at': None
+        }
+
+    def update(self, **sections):
+        """
+        Info:   Replace or merge snapshot sections and publish the snapshot
+        Input:  sections - kwargs = section name to value, dict values are merged into the section
+        """
+        with self._lock:
+            for key, value in sections.items():
+                if isinstance(value, dict) and isinstance(self.data.get(key), dict):
+                    self.data[key].update(value)
+                else:
+                    self.data[key] = value
+            self.data['updated_at'] = str(dt.datetime.utcnow())
+
+            if self.path is not None:
+                self._write()
+
+    def _write(self):
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                       suffix='.tmp',
+                                       dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f, default=str)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            get_logger(self.log_file).log(f'Status {self.path} - {e}', stage='status')
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def get(self):
+        """
+        Output: dict = current snapshot
+        """
+        with self._lock:
+            return dict(self.data)
+
+
+class FileSource:
+    """
+    Info:   Snapshot published by another process, reloaded only when the file changes
+    Path:   NA
+    """
+
+    def __init__(self, path='status.json'):
+        self.path = path
+        self.mtime = None
+        self.data = {}
+
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return self.data
+        if mtime != self.mtime:
+            try:
+                with open(self.path) as f:
+                    self.data = json.load(f)
+                self.mtime = mtime
+            except ValueError:
+                pass
+        return self.data
+
+
+async def handle(reader, writer, source):
+    """
+    Info:   Serve one HTTP GET request from the snapshot
+    Path:   NA
+    Note:   Routes: / (everything), /positions, /signals, /timings, /fetch, /health
+    """
+
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request.decode('latin-1').split()
+        path = parts[1].split('?')[0].strip('/') if len(parts) > 1 else ''
+
+        data = source.get()
+        if parts and parts[0] != 'GET':
+            status, body = '405 Method Not Allowed', {'error': 'read-only'}
+        elif path == '':
+            status, body = '200 OK', data
+        elif path == 'health':
+            status, body = '200 OK', {
+                'updated_at': data.get('updated_at'),
+                **data.get('fetch', {})
+            }
+        elif path in data:
+            status, body = '200 OK', data[path]
+        else:
+            status, body = '404 Not Found', {'error': path}
+
+        payload = json.dumps(body, default=str).encode()
+        writer.write(('HTTP/1.1 {0}\r\n'
+                      'Content-Type: application/json\r\n'
+                      'Content-Length: {1}\r\n'
+                      'Connection: close\r\n\r\n').format(status, len(payload)).encode() +
+                     payload)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(source, host='127.0.0.1', port=8765):
+    """
+    Info:   Run the read-only status API
+    Path:   NA
+    Input:  source - Snapshot/FileSource = object with get() returning the snapshot
+            host   - string              = address to bind
+            port   - int                 = port to bind
+    Output: NA, serves until cancelled
+    """
+
+    server = await asyncio.start_server(
+        lambda r, w: handle(r, w, source), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def start_in_thread(source, host='127.0.0.1', port=8765):
+    """
+    Info:   Run the status API in a daemon thread of the current process
+    Path:   NA
+    Output: Thread
+    """
+
+    thread = threading.Thread(target=asyncio.run,
+                              args=(serve(source, host, port), ),
+                              name='status-api',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file', default='status.json',
+                        help='snapshot file written by main.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    asyncio.run(serve(FileSource(args.file), args.host, args.port))
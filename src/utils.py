@@ -2,21 +2,85 @@ import sqlite3 as lite
 
 import pandas as pd
 import csv
-import struct
+import numpy as np
 from numpy import array
 import datetime as dt
 import configparser
 
+# orjson is optional, faster than json on the Pi
+try:
+    import orjson as json_lib
+except ImportError:
+    import json as json_lib
+
 from tabulate import tabulate
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.message import EmailMessage
 import smtplib
-import socket
 
-from sys import platform
-if platform == "win32":
-    import win32api
+from logger import get_logger
+import indicators as ind
+
+watermark_tbl = 'watermarks'
+_watermarks = {}
+
+# Missing candle ranges the exchange has no data for (maintenance, suspended pairs)
+gap_tbl = 'kline_gaps'
+
+exec_tbl = 'exec_ledger'
+
+# Latency of an order between two of its ledger timestamps (ms)
+exec_latency = {
+    'close_to_signal_ms': ('close_ms', 'signal_ms'),
+    'signal_to_submit_ms': ('signal_ms', 'submit_ms'),
+    'submit_to_ack_ms': ('submit_ms', 'ack_ms'),
+    'submit_to_fill_ms': ('submit_ms', 'transact_ms'),
+    'close_to_fill_ms': ('close_ms', 'transact_ms')
+}
+
+# PnL rollup tables and their key column
+rollup_tbl = {
+    'pnl_session': 'session',
+    'pnl_daily': 'day',
+    'pnl_strategy': 'strategy',
+    'pnl_pair': 'pair'
+}
+
+# Kline table columns and SQLite types, in the order of the Binance kline payload
+kline_schema = {
+    'timestamp': 'INTEGER',
+    'open': 'REAL',
+    'high': 'REAL',
+    'low': 'REAL',
+    'close': 'REAL',
+    'volume': 'REAL',
+    'close_time': 'INTEGER',
+    'quote_av': 'REAL',
+    'trades': 'INTEGER',
+    'tb_base_av': 'REAL',
+    'tb_quote_av': 'REAL'
+}
+
+kline_dtype = np.dtype([(k, 'int64' if v == 'INTEGER' else 'float64')
+                        for k, v in kline_schema.items()])
+
+interval_ms = {
+    '1m': 60000,
+    '3m': 180000,
+    '5m': 300000,
+    '15m': 900000,
+    '30m': 1800000,
+    '1h': 3600000,
+    '2h': 7200000,
+    '4h': 14400000,
+    '6h': 21600000,
+    '8h': 28800000,
+    '12h': 43200000,
+    '1d': 86400000,
+    '3d': 259200000,
+    '1w': 604800000
+}
 
 ###########################################################################################################################################
 # UTILITIES
@@ -35,6 +99,9 @@ def gen_mail(db, txn_tbl, signal_tbl, receiver, data_quality, txn_time):
 
     # Get mail content
     con = lite.connect(db)
+    for tbl in [signal_tbl, txn_tbl]:
+        con.execute('create index if not exists ix_{0}_timestamp on {0} (timestamp)'.format(tbl))
+    con.commit()
 
     signal = pd.read_sql(
         """select  pair,
@@ -84,11 +151,19 @@ def gen_mail(db, txn_tbl, signal_tbl, receiver, data_quality, txn_time):
     server = config.get("incident", "server")
 
     text = """
-    {table}"""
+    {table}
+
+    {summary}
+
+    {execution}"""
 
     html = """
     <html><body>
     {table}
+    <br>
+    {summary}
+    <br>
+    {execution}
     </body></html>
     """
 
@@ -96,10 +171,22 @@ def gen_mail(db, txn_tbl, signal_tbl, receiver, data_quality, txn_time):
         reader = csv.reader(input_file)
         data = list(reader)
 
+    # Precomputed PnL aggregates
+    summary = get_pnl_summary(db, txn_time) if is_tbl_exist(
+        'equity_curve', db) else pd.DataFrame()
+
+    # Execution latency and slippage of the session
+    execution = get_exec_summary(db, txn_time) if is_tbl_exist(
+        exec_tbl, db) else pd.DataFrame()
+
     text = text.format(
-        table=tabulate(data, headers="firstrow", tablefmt="simple"))
+        table=tabulate(data, headers="firstrow", tablefmt="simple"),
+        summary=tabulate(summary, headers="keys", tablefmt="simple", showindex=False),
+        execution=tabulate(execution, headers="keys", tablefmt="simple", showindex=False))
     html = html.format(
-        table=tabulate(data, headers="firstrow", tablefmt="html"))
+        table=tabulate(data, headers="firstrow", tablefmt="html"),
+        summary=tabulate(summary, headers="keys", tablefmt="html", showindex=False),
+        execution=tabulate(execution, headers="keys", tablefmt="html", showindex=False))
 
     message = MIMEMultipart(
         "alternative", None,
@@ -173,65 +260,18 @@ def get_min_txn(db, map_tbl, pair):
     return rs
 
 
-def sync_time():
-    """
-    Info:   Update system time
-    Path:   NA
-    Input:  NA
-    Output: Updated system time
-    """
-
-    server_list = [
-        'time.windows.com', 'pool.ntp.org', 'ntp.iitb.ac.in', 'time.nist.gov'
-    ]
-
-    for addr in server_list:
-        # http://code.activestate.com/recipes/117211-simple-very-sntp-client/
-        epoch_time = None
-        TIME1970 = 2208988800  # Thanks to F.Lundh
-        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        data = '\x1b' + 47 * '\0'
-        data = data.encode()
-        try:
-            # Timing out the connection after 5 seconds, if no response received
-            client.settimeout(5.0)
-            client.sendto(data, (addr, 123))
-            data, address = client.recvfrom(1024)
-            if data:
-                epoch_time = struct.unpack('!12I', data)[10]
-                epoch_time -= TIME1970
-        except socket.timeout:
-            pass
-
-        if epoch_time is not None:
-            # SetSystemTime takes time as argument in UTC time. UTC time is obtained using utcfromtimestamp()
-            utcTime = dt.datetime.utcfromtimestamp(epoch_time)
-            win32api.SetSystemTime(utcTime.year, utcTime.month,
-                                   utcTime.weekday(), utcTime.day,
-                                   utcTime.hour, utcTime.minute,
-                                   utcTime.second, 0)
-            # Local time is obtained using fromtimestamp()
-            localTime = dt.datetime.fromtimestamp(epoch_time)
-            log(
-                'log_master_code.log', "Time updated to: " +
-                localTime.strftime("%Y-%m-%d %H:%M") + " from " + addr)
-            return True
-
-    sync_time()
-
-
-def log(file, string):
+def log(file, string, **fields):
     """
     Info:   Generate/append in a log
     Path:   NA
     Input:  file       - string = output log file name
             string     - string = content to be logged
+            fields     - kwargs = structured fields (pair, stage, latency...)
     Output: file log
+    Note:   Only queues the line, the file is written by logger.BufferedLogger
     """
 
-    log = open(file, 'a+')
-    log.write('{0} - {1}\n'.format(
-        str(dt.datetime.utcnow() + dt.timedelta(hours=7)), string))
+    get_logger(file).log(string, **fields)
 
 
 def get_latest_txn_time(is_lag=True):
@@ -293,20 +333,24 @@ def EMA(ts, timespan):
             timespan - int        = the timespan EMA will be calculated on
     Output: timeseries            = Return a series of EMA according to the timeseries
     """
-    return ts.ewm(span=timespan, adjust=False).mean()
+    return pd.Series(ind.ema(ts.to_numpy(dtype='float64'), timespan),
+                     index=ts.index)
 
 
-def simulate(df, ema, cut_loss):
+def simulate(df, ema, cut_loss, ema_values=None):
     """
     Info:   Simulate
     Path:   NA
-    Input:  df       - dataframe = dataframe that will be simulated
-            ema      - int       = ema signal
-            cut_loss - float     = cut loss percentage
-    Output: A list               = Return a list of [pnl total (float); (dataframe) of trading according to timeseries]
+    Input:  df         - dataframe = dataframe that will be simulated
+            ema        - int       = ema signal
+            cut_loss   - float     = cut loss percentage
+            ema_values - ndarray   = precomputed EMA of df['close'], computed if None
+    Output: A list                 = Return a list of [pnl total (float); (dataframe) of trading according to timeseries]
     """
 
-    df['ema'] = df['close'].ewm(span=ema, adjust=False).mean()
+    if ema_values is None:
+        ema_values = ind.ema(df['close'].to_numpy(dtype='float64'), ema)
+    df = df.assign(ema=ema_values)
     df = df.dropna()
 
     bud = 100
@@ -404,18 +448,19 @@ Input:
     latest_txn_time - datetime = latest transaction time to check for
 Output:
     Number of pair have the expected data
+Note:
+    Reads the in-memory watermarks, no pair table is scanned
     """
 
-    conn = lite.connect(db)
-    df = None
+    latest_ts = to_ms(latest_txn_time)
+
+    num_of_complete = 0
     for pair in pair_list:
-        tmp_df = pd.read_sql(
-            f"select * from {pair} where timestamp='{latest_txn_time}'", conn)
-        if df is None:
-            df = tmp_df
-        else:
-            df = pd.concat([df, tmp_df])
-    return len(df)
+        last_ts = get_watermark(db, pair)
+        if last_ts is not False and last_ts >= latest_ts:
+            num_of_complete += 1
+
+    return num_of_complete
 
 
 def get_date(db, tbl, where):
@@ -445,20 +490,570 @@ def get_date(db, tbl, where):
         return False
 
 
-def get_pair_data(pair, db):
+def ini_watermark_tbl(con):
+    """
+    Info:   Create the watermarks table if it does not exist
+    Path:   NA
+    Input:  con - connection = SQLite connection
+    Output: watermarks table = one row per (pair, interval, strategy)
+            strategy is '' for kline rows and the strategy code for signal rows
+            last_ts is the open time of the last candle in epoch ms (UTC)
+            last_signal_ts is the timestamp of the last signal as stored in signal_tbl
+    """
+
+    con.execute("""create table if not exists {0} (
+                       pair            text not null,
+                       interval        text not null,
+                       strategy        text not null default '',
+                       last_ts         integer,
+                       last_signal_ts  text,
+                       rows            integer not null default 0,
+                       primary key (pair, interval, strategy))""".format(
+        watermark_tbl))
+
+
+def load_watermarks(db, reload=False, con=None):
+    """
+    Info:   Load the watermarks table into memory, once per run
+    Path:   NA
+    Input:  db     - string     = database name
+            reload - bool       = force reading the table again
+            con    - connection = connection to read with, a new one is opened if None
+    Output: dict                = {(pair, interval, strategy): {last_ts, last_signal_ts, rows}}
+    """
+
+    if db in _watermarks and not reload:
+        return _watermarks[db]
+
+    own_con = con is None
+    if own_con:
+        con = lite.connect(db)
+    ini_watermark_tbl(con)
+    if own_con:
+        con.commit()
+    cur = con.execute(
+        'select pair, interval, strategy, last_ts, last_signal_ts, rows from {0}'
+        .format(watermark_tbl))
+    _watermarks[db] = {(r[0], r[1], r[2]): {
+        'last_ts': None if r[3] in (None, '') else int(r[3]),
+        'last_signal_ts': None if r[4] in (None, '') else r[4],
+        'rows': r[5]
+    } for r in cur.fetchall()}
+    if own_con:
+        con.close()
+
+    return _watermarks[db]
+
+
+def update_watermark(con,
+                     db,
+                     pair,
+                     interval='8h',
+                     strategy='',
+                     last_ts=None,
+                     last_signal_ts=None,
+                     rows=0):
+    """
+    Info:   Move a watermark forward inside the caller's transaction
+    Path:   NA
+    Input:  con            - connection = SQLite connection used for the data write (not committed here)
+            db             - string     = database name
+            pair           - string     = pair name
+            interval       - string     = kline interval
+            strategy       - string     = strategy code, '' for klines
+            last_ts        - int        = open time of the last written candle (epoch ms)
+            last_signal_ts - string     = timestamp of the last written signal
+            rows           - int        = number of rows written
+    Output: Updated watermarks table row and in-memory watermark
+    Note:   The in-memory watermark is the reference, the row is overwritten with it
+    """
+
+    mark = load_watermarks(db, con=con).setdefault((pair, interval, strategy), {
+        'last_ts': None,
+        'last_signal_ts': None,
+        'rows': 0
+    })
+    if last_ts is not None:
+        mark['last_ts'] = max(mark['last_ts'] or 0, int(last_ts))
+    if last_signal_ts is not None:
+        mark['last_signal_ts'] = max(mark['last_signal_ts'] or '',
+                                     str(last_signal_ts))
+    mark['rows'] += int(rows)
+
+    con.execute(
+        """insert into {0} (pair, interval, strategy, last_ts, last_signal_ts, rows)
+           values (?, ?, ?, ?, ?, ?)
+           on conflict (pair, interval, strategy) do update set
+               last_ts = excluded.last_ts,
+               last_signal_ts = excluded.last_signal_ts,
+               rows = excluded.rows""".format(watermark_tbl),
+        (pair, interval, strategy, mark['last_ts'], mark['last_signal_ts'],
+         mark['rows']))
+
+
+def get_watermark(db, pair, interval='8h', strategy=''):
+    """
+    Info:   Get the last written candle of a pair or the last signal of a pair strategy
+    Path:   NA
+    Input:  db       - string = database name
+            pair     - string = pair name
+            interval - string = kline interval
+            strategy - string = strategy code, '' for klines
+    Output: int                = open time of the last candle in epoch ms (klines)
+            dataframe.datetime = timestamp of the last signal (strategy given)
+            False if nothing has been written yet
+    Note:   A missing watermark is seeded once from the existing table, then it is a dict lookup
+    """
+
+    marks = load_watermarks(db)
+    key = (pair, interval, strategy)
+
+    if key not in marks:
+        con = lite.connect(db)
+        if strategy == '':
+            latest_ts, rows = None, 0
+            if is_tbl_exist(pair, db):
+                latest_ts, rows = con.execute(
+                    'select max(timestamp), count(*) from {0}'.format(
+                        pair)).fetchone()
+            if latest_ts is None:
+                marks[key] = {'last_ts': None, 'last_signal_ts': None, 'rows': 0}
+            else:
+                update_watermark(con, db, pair, interval, last_ts=latest_ts,
+                                 rows=rows)
+        else:
+            where = "where pair='{0}' and strategy='{1}'".format(pair, strategy)
+            latest_date = get_date(db, 'signal_tbl', where)
+            if latest_date is False:
+                marks[key] = {'last_ts': None, 'last_signal_ts': None, 'rows': 0}
+            else:
+                rows = con.execute('select count(*) from signal_tbl {0}'.format(
+                    where)).fetchone()[0]
+                update_watermark(con, db, pair, interval, strategy,
+                                 last_signal_ts=latest_date, rows=rows)
+        con.commit()
+        con.close()
+
+    if strategy == '':
+        value = marks[key]['last_ts']
+        return False if value is None else value
+
+    value = marks[key]['last_signal_ts']
+    return False if value is None else pd.Timestamp(value)
+
+
+def to_ms(ts):
+    """
+    Info:   Convert a local batch timestamp (UTC+7, as used in signal_tbl/txn_tbl) to epoch ms
+    Path:   NA
+    Input:  ts  - datetime/string = local timestamp
+    Output: int                   = epoch ms (UTC)
+    """
+    return int((pd.Timestamp(ts) - dt.timedelta(hours=7)).value // 10**6)
+
+
+def from_ms(ms):
+    """
+    Info:   Convert epoch ms (UTC) to local timestamps (UTC+7)
+    Path:   NA
+    Input:  ms  - int/array/series = epoch ms
+    Output: datetime/series        = local timestamps
+    """
+    return pd.to_datetime(ms, unit='ms') + dt.timedelta(hours=7)
+
+
+def ini_kline_tbl(con, pair):
+    """
+    Info:   Create the typed kline table of a pair, migrating a legacy table if needed
+    Path:   NA
+    Input:  con  - connection = SQLite connection
+            pair - string     = pair name
+    Output: pair table        = REAL prices/volumes, INTEGER trades, INTEGER epoch ms (UTC) timestamps,
+                                WITHOUT ROWID clustered on timestamp
+    """
+
+    cols = {
+        r[1]: r[2].upper()
+        for r in con.execute('pragma table_info({0})'.format(pair)).fetchall()
+    }
+
+    if cols and cols.get('timestamp') != 'INTEGER':
+        migrate_kline_tbl(con, pair)
+    elif not cols:
+        con.execute("""create table if not exists {0} (
+                           {1},
+                           primary key (timestamp)
+                       ) without rowid""".format(
+            pair, ',\n                           '.join(
+                '{0} {1} not null'.format(k, v) if k == 'timestamp' else
+                '{0} {1}'.format(k, v) for k, v in kline_schema.items())))
+        con.commit()
+
+
+def decode_klines(payload, out=None):
+    """
+    Info:   Decode a Binance kline page straight into a structured array
+    Path:   NA
+    Input:  payload - bytes/list = raw JSON body, or the list of kline lists already parsed
+            out     - ndarray    = kline_dtype array to fill from its start, a new one if None
+    Output: ndarray              = kline_dtype rows of the page (a view of out if given)
+    Note:   Raw bodies are parsed with orjson when installed. Each column is converted once
+            from the page, without the DataFrame, astype and index copies of kline_frame.
+    """
+
+    if isinstance(payload, (bytes, bytearray, str)):
+        payload = json_lib.loads(payload)
+
+    n = len(payload)
+    out = np.empty(n, kline_dtype) if out is None else out[:n]
+    if n != 0:
+        cols = np.array(payload, dtype=object)
+        for i, k in enumerate(kline_dtype.names):
+            out[k] = cols[:, i]
+
+    return out
+
+
+class KlineBuffer:
+    """
+    Info:   Kline pages of one request accumulated in a single structured array
+    Path:   NA
+    Note:   Pages are decoded in place after the rows already stored. The array doubles when
+            full, so a long history costs a few reallocations instead of a concatenation per page.
+    """
+
+    def __init__(self, capacity=1000):
+        self._data = np.empty(capacity, kline_dtype)
+        self.n = 0
+
+    def extend(self, payload):
+        """
+        Info:   Decode a page at the end of the buffer
+        Input:  payload - bytes/list = page as accepted by decode_klines
+        Output: ndarray              = rows of the page
+        """
+        if isinstance(payload, (bytes, bytearray, str)):
+            payload = json_lib.loads(payload)
+        if self.n + len(payload) > len(self._data):
+            data = np.empty(max(2 * len(self._data), self.n + len(payload)), kline_dtype)
+            data[:self.n] = self._data[:self.n]
+            self._data = data
+        page = decode_klines(payload, self._data[self.n:])
+        self.n += len(page)
+        return page
+
+    @property
+    def rows(self):
+        """
+        Output: ndarray = every row decoded so far
+        """
+        return self._data[:self.n]
+
+
+def kline_frame(klines):
+    """
+    Info:   Build a typed DataFrame from a Binance kline payload
+    Path:   NA
+    Input:  klines - list = list of kline lists (strings and ints) from the api
+    Output: dataframe     = kline_schema columns, int64 epoch ms timestamps, float64 prices
+    """
+
+    return pd.DataFrame(decode_klines(klines))
+
+
+def write_klines(con, db, pair, rows, interval='8h'):
+    """
+    Info:   Idempotent bulk upsert of klines into a pair table
+    Path:   NA
+    Input:  con      - connection = SQLite connection
+            db       - string     = database name
+            pair     - string     = pair name
+            rows     - list       = tuples in kline_schema column order (or a typed kline
+                                    DataFrame, or a kline_dtype array)
+            interval - string     = kline interval
+    Output: int                   = number of new candles
+    Note:   One transaction per batch: executemany insert ... on conflict (timestamp) do update,
+            then the watermark update. Rerunning the same batch only rewrites the same rows.
+    """
+
+    with con:
+        return upsert_klines(con, db, pair, rows, interval)
+
+
+def upsert_klines(con, db, pair, rows, interval='8h'):
+    """
+    Info:   Body of write_klines inside the caller's transaction (not committed here)
+    Path:   NA
+    Input:  see write_klines
+    Output: int = number of new candles
+    """
+
+    if isinstance(rows, pd.DataFrame):
+        rows = list(rows[list(kline_schema)].itertuples(index=False, name=None))
+    elif isinstance(rows, np.ndarray):
+        rows = rows.tolist()
+    if len(rows) == 0:
+        return 0
+
+    ts = [r[0] for r in rows]
+    first_ts, last_ts = min(ts), max(ts)
+
+    existing = con.execute(
+        'select count(*) from {0} where timestamp between ? and ?'.format(
+            pair), (first_ts, last_ts)).fetchone()[0]
+    con.executemany(
+        """insert into {0} ({1}) values ({2})
+           on conflict (timestamp) do update set {3}""".format(
+            pair, ', '.join(kline_schema),
+            ', '.join('?' * len(kline_schema)),
+            ', '.join('{0}=excluded.{0}'.format(k)
+                      for k in kline_schema if k != 'timestamp')), rows)
+    new_rows = len(set(ts)) - existing
+    update_watermark(con, db, pair, interval, last_ts=last_ts, rows=new_rows)
+
+    return new_rows
+
+
+def write_signals(con, db, signal_tbl, signals):
+    """
+    Info:   Append signals and move the signal watermarks in one transaction
+    Path:   NA
+    Input:  con        - connection = SQLite connection
+            db         - string     = database name
+            signal_tbl - string     = signal table name
+            signals    - dataframe  = timestamp, pair, strategy, action, buy_price, sell_price
+    Output: int                     = number of signals written
+    Note:   Same pattern as write_klines: a crash can not leave signals behind their watermark,
+            which would have them appended (and traded) again by the next run
+    """
+
+    if len(signals) == 0:
+        return 0
+
+    num = lambda x: None if x is None or pd.isna(x) else float(x)
+    rows = [(str(pd.Timestamp(ts)), pair, strategy, action, num(buy_price), num(sell_price))
+            for ts, pair, strategy, action, buy_price, sell_price in signals[[
+                'timestamp', 'pair', 'strategy', 'action', 'buy_price', 'sell_price'
+            ]].itertuples(index=False, name=None)]
+
+    with con:
+        con.execute("""create table if not exists {0} (
+                           timestamp   timestamp,
+                           pair        text,
+                           strategy    text,
+                           action      text,
+                           buy_price   real,
+                           sell_price  real)""".format(signal_tbl))
+        con.executemany(
+            'insert into {0} (timestamp, pair, strategy, action, buy_price, sell_price) '
+            'values (?, ?, ?, ?, ?, ?)'.format(signal_tbl), rows)
+        for (pair, strategy), group in signals.groupby(['pair', 'strategy'], sort=False):
+            update_watermark(con,
+                             db,
+                             pair,
+                             strategy=strategy,
+                             last_signal_ts=str(pd.Timestamp(group['timestamp'].max())),
+                             rows=len(group))
+
+    return len(rows)
+
+
+def migrate_kline_tbl(con, pair):
+    """
+    Info:   Migrate a legacy to_sql kline table (TEXT columns, shifted datetime strings) to the typed schema
+    Path:   NA
+    Input:  con  - connection = SQLite connection
+            pair - string     = pair name
+    Output: pair table        = typed table, duplicated candles keep the last inserted row
+    """
+
+    legacy = pair + '_legacy'
+    con.execute('alter table {0} rename to {1}'.format(pair, legacy))
+    ini_kline_tbl(con, pair)
+
+    select = {
+        'timestamp':
+        "(cast(strftime('%s', timestamp) as integer) - 7 * 3600) * 1000",
+    }
+    con.execute("""insert or replace into {0} ({1})
+                   select {2} from {3} order by rowid""".format(
+        pair, ', '.join(kline_schema),
+        ', '.join(
+            select.get(k, 'cast({0} as {1})'.format(k, v))
+            for k, v in kline_schema.items()), legacy))
+    con.execute('drop table {0}'.format(legacy))
+
+    # The watermark is seeded again from the typed table
+    ini_watermark_tbl(con)
+    con.execute("delete from {0} where pair=? and strategy=''".format(
+        watermark_tbl), (pair, ))
+    for db in _watermarks:
+        for key in [k for k in _watermarks[db] if k[0] == pair and k[2] == '']:
+            del _watermarks[db][key]
+    con.commit()
+
+
+def get_pair_data(pair,
+                  db,
+                  start_date=None,
+                  end_date=None,
+                  columns=('timestamp', 'close'),
+                  chunksize=None,
+                  as_array=False):
     """
     Info:   Get data of a pair from database
     Path:   NA
-    Input:  pair    - string    = pair name
-            db      - string    = database dir
-    Output: df      - dataframe = dataframe with pair data
+    Input:  pair       - string    = pair name
+            db         - string    = database dir
+            start_date - datetime  = only candles after this local timestamp (UTC+7)
+            end_date   - datetime  = only candles up to this local timestamp (UTC+7)
+            columns    - tuple     = kline_schema columns to read
+            chunksize  - int       = yield chunks of this many rows instead of one result
+            as_array   - bool      = return a NumPy structured array (timestamp in epoch ms)
+    Output: df         - dataframe = dataframe with pair data (timestamp as UTC+7 datetime)
+                         ndarray   = structured array if as_array
+                         generator = of the above if chunksize
+    Note:   Time range and columns are filtered in SQL on the integer primary key,
+            only the requested window is materialized
+    """
+
+    where, params = [], []
+    if start_date is not None:
+        where.append('timestamp > ?')
+        params.append(to_ms(start_date))
+    if end_date is not None:
+        where.append('timestamp <= ?')
+        params.append(to_ms(end_date))
+    query = 'select {0} from {1} {2} order by timestamp'.format(
+        ', '.join(columns), pair, 'where ' + ' and '.join(where) if where else '')
+    dtype = [(c, 'int64' if kline_schema[c] == 'INTEGER' else 'float64')
+             for c in columns]
+
+    def to_frame(df):
+        if 'timestamp' in df:
+            df['timestamp'] = from_ms(df['timestamp'])
+        return df.astype({c: t for c, t in dtype if c != 'timestamp'})
+
+    def read_chunks():
+        con = lite.connect(db)
+        try:
+            if as_array:
+                cur = con.execute(query, params)
+                rows = cur.fetchmany(chunksize)
+                while rows:
+                    yield np.array(rows, dtype=dtype)
+                    rows = cur.fetchmany(chunksize)
+            else:
+                for df in pd.read_sql(query, con, params=params, chunksize=chunksize):
+                    yield to_frame(df)
+        finally:
+            con.close()
+
+    if chunksize is not None:
+        return read_chunks()
+
+    con = lite.connect(db)
+    if as_array:
+        data = np.array(con.execute(query, params).fetchall(), dtype=dtype)
+    else:
+        data = to_frame(pd.read_sql(query, con, params=params))
+    con.close()
+
+    return data
+
+
+def ini_gap_tbl(con):
+    """
+    Info:   Create the table of known empty kline ranges if it does not exist
+    Path:   NA
+    Input:  con - connection = SQLite connection
+    Output: kline_gaps table = one row per range the exchange returned no candles for,
+                               start_ms/end_ms are open times in epoch ms (UTC)
     """
+
+    con.execute("""create table if not exists {0} (
+                       pair      text not null,
+                       interval  text not null,
+                       start_ms  integer not null,
+                       end_ms    integer not null,
+                       primary key (pair, interval, start_ms))""".format(gap_tbl))
+
+
+def find_gaps(db, pair_list, interval='8h', end_ms=None):
+    """
+    Info:   Find missing candles of every pair against the interval grid
+    Path:   NA
+    Input:  db        - string = database name
+            pair_list - list   = pairs to be scanned
+            interval  - string = kline interval
+            end_ms    - int    = open time of the last expected candle (epoch ms),
+                                 the tail after the last stored candle is not checked if None
+    Output: dataframe          = pair, start_ms, end_ms (open times of the first and last
+                                 missing candle) and candles, one row per gap
+    Note:   Timestamps of all pairs are concatenated and diffed in one vectorized pass.
+            History before the first stored candle is not a gap, and ranges recorded
+            in kline_gaps as empty on the exchange are left out.
+    """
+
+    step = interval_ms[interval]
+    names, ts = [], []
+    for pair in pair_list:
+        if not is_tbl_exist(pair, db):
+            continue
+        arr = get_pair_data(pair, db, columns=('timestamp', ), as_array=True)['timestamp']
+        if len(arr) == 0:
+            continue
+        if end_ms is not None and arr[-1] < end_ms:
+            # Sentinel one candle after the expected end closes the tail gap
+            arr = np.append(arr, end_ms + step)
+        names.append(pair)
+        ts.append(arr)
+
+    columns = ['pair', 'start_ms', 'end_ms', 'candles']
+    if len(ts) == 0:
+        return pd.DataFrame(columns=columns)
+
+    pid = np.repeat(np.arange(len(ts)), [len(a) for a in ts])
+    ts = np.concatenate(ts)
+
+    diff = np.diff(ts)
+    is_gap = (pid[1:] == pid[:-1]) & (diff > step)
+    gaps = pd.DataFrame({
+        'pair': np.array(names)[pid[1:][is_gap]],
+        'start_ms': ts[:-1][is_gap] + step,
+        'end_ms': ts[1:][is_gap] - step,
+        'candles': diff[is_gap] // step - 1
+    }, columns=columns)
+
     con = lite.connect(db)
-    df = pd.read_sql('select timestamp, close from {0}'.format(pair), con)
+    ini_gap_tbl(con)
+    known = pd.read_sql('select pair, start_ms, end_ms from {0} where interval=?'.format(gap_tbl),
+                        con, params=(interval, ))
+    con.close()
+    if len(known) != 0:
+        gaps = gaps.merge(known, how='left', on=['pair', 'start_ms', 'end_ms'],
+                          indicator=True)
+        gaps = gaps.loc[gaps['_merge'] == 'left_only', columns]
 
-    df = df.astype({'timestamp': 'datetime64', 'close': 'float64'})
+    return gaps.reset_index(drop=True)
 
-    return df
+
+def mark_empty_gap(con, pair, interval, start_ms, end_ms):
+    """
+    Info:   Record a kline range the exchange has no candles for, so it is not fetched again
+    Path:   NA
+    Input:  con      - connection = SQLite connection
+            pair     - string     = pair name
+            interval - string     = kline interval
+            start_ms - int        = open time of the first missing candle (epoch ms)
+            end_ms   - int        = open time of the last missing candle (epoch ms)
+    """
+
+    with con:
+        ini_gap_tbl(con)
+        con.execute(
+            'insert or replace into {0} (pair, interval, start_ms, end_ms) values (?, ?, ?, ?)'
+            .format(gap_tbl), (pair, interval, int(start_ms), int(end_ms)))
 
 
 def is_tbl_exist(tbl_name, db):
@@ -513,112 +1108,404 @@ def log_order(db, txn_tbl, order, action, strategy, timestamp):
             action    - string             = BUY/SELL/CUT_SELL
             strategy  - string             = strategy code
             timestamp - dataframe.datetime = batch timestamp
-    Output: Data into txn_tbl (SQLite table)
+    Output: Data into txn_tbl (SQLite table) and the PnL rollups, in one transaction
     """
 
     con = lite.connect(db)
-    pnl = ini_txn_tbl()
+    ini_rollup_tbl(con, db, txn_tbl)
+
+    qty = float(order['executedQty'])
+    quote_qty = float(order['cummulativeQuoteQty'])
+
+    row = {
+        'timestamp': str(pd.Timestamp(timestamp)),
+        'timestamp_txn': str(from_ms(order['transactTime'])),
+        'order_id': order['orderId'],
+        'pair': order['symbol'],
+        'strategy': strategy,
+        'action': action,
+        'buy_price': None,
+        'sell_price': None,
+        'qty': order['executedQty'],
+        'quote_qty': order['cummulativeQuoteQty'],
+        'commission': None,
+        'commission_asset': None,
+        'quote_commision': None,
+        'is_sold': 0,
+        'pnl': 0
+    }
+    buy_quote = None
 
     if action == 'BUY':
-        pair = lambda x, y: x + 'USDT' if (x != 'USDT') else 'USDT'
-
-        pnl = pnl.append(
-            {
-                'timestamp':
-                timestamp,
-                'timestamp_txn':
-                order['transactTime'],
-                'order_id':
-                order['orderId'],
-                'pair':
-                order['symbol'],
-                'strategy':
-                strategy,
-                'action':
-                action,
-                'buy_price':
-                float(order['cummulativeQuoteQty']) /
-                float(order['executedQty']),
-                'sell_price':
-                None,
-                'qty':
-                order['executedQty'],
-                'quote_qty':
-                order['cummulativeQuoteQty'],
-                'commission':
-                None,
-                'commission_asset':
-                None,
-                'quote_commision':
-                None,
-                'is_sold':
-                0,
-                'pnl':
-                0
-            },
-            ignore_index=True)
-        # pnl['timestamp'] = pd.to_datetime(pnl['timestamp'], unit='ms') + dt.timedelta(hours=7)
-        pnl['timestamp_txn'] = pd.to_datetime(
-            pnl['timestamp_txn'], unit='ms') + dt.timedelta(hours=7)
-
-        pnl.to_sql(txn_tbl, con, if_exists='append', index=False)
+        row['buy_price'] = quote_qty / qty
 
     elif action in ['SELL', 'CUT_SELL']:
-        tmp = pd.read_sql(
+        buy_price, buy_quote = con.execute(
             """select buy_price, quote_qty from {0} where pair='{1}' and strategy='{2}' and is_sold=0"""
-            .format(txn_tbl, order['symbol'], strategy), con)
+            .format(txn_tbl, order['symbol'], strategy)).fetchone()
+        buy_quote = float(buy_quote)
 
         #BACKLOG FOR COMMISSION pair = lambda x, y: x+'USDT' if (x!='USDT') else 'USDT'
-        pnl = pnl.append(
-            {
-                'timestamp':
-                timestamp,
-                'timestamp_txn':
-                order['transactTime'],
-                'order_id':
-                order['orderId'],
-                'pair':
-                order['symbol'],
-                'strategy':
-                strategy,
-                'action':
-                action,
-                'buy_price':
-                tmp['buy_price'][0],
-                'sell_price':
-                float(order['cummulativeQuoteQty']) /
-                float(order['executedQty']),
-                'qty':
-                order['executedQty'],
-                'quote_qty':
-                order['cummulativeQuoteQty'],
-                'commission':
-                None,
-                'commission_asset':
-                None,
-                'quote_commision':
-                None,
-                'is_sold':
-                1,
-                'pnl':
-                (float(order['cummulativeQuoteQty']) -
-                 float(tmp['quote_qty'][0])) * 100 / float(tmp['quote_qty'][0])
-            },
-            ignore_index=True)
-        # pnl['timestamp'] = pd.to_datetime(pnl['timestamp'], unit='ms') + dt.timedelta(hours=7)
-        pnl['timestamp_txn'] = pd.to_datetime(
-            pnl['timestamp_txn'], unit='ms') + dt.timedelta(hours=7)
+        row['buy_price'] = buy_price
+        row['sell_price'] = quote_qty / qty
+        row['is_sold'] = 1
+        row['pnl'] = (quote_qty - buy_quote) * 100 / buy_quote
 
+    else:
+        return
+
+    with con:
         # Update new order
-        pnl.to_sql(txn_tbl, con, if_exists='append', index=False)
+        con.execute(
+            'insert into {0} ({1}) values ({2})'.format(
+                txn_tbl, ', '.join(row), ', '.join('?' * len(row))),
+            list(row.values()))
 
         # Update old order is_sold status
-        cur = con.cursor()
-        cur.execute(""" update  {0}
-                        set     is_sold=1
-                        where   pair='{1}' and strategy='{2}' and is_sold=0""".
-                    format(txn_tbl, order['symbol'], strategy))
-        con.commit()
+        if action != 'BUY':
+            con.execute(""" update  {0}
+                            set     is_sold=1
+                            where   pair='{1}' and strategy='{2}' and is_sold=0""".
+                        format(txn_tbl, order['symbol'], strategy))
+
+        update_rollups(con, row['timestamp'], row['pair'], row['strategy'],
+                       action, quote_qty, buy_quote)
+    con.close()
+
+
+def net_fills(order, pair, price, sell_qty, buy_quote, transact_ms):
+    """
+    Info:   Allocate the fill of one netted order back to the strategies of a pair
+    Path:   NA
+    Input:  order       - dict    = exchange order response, None if the signals cancelled out
+            pair        - string  = pair name
+            price       - float   = reference price the crossed part is matched at
+            sell_qty    - ndarray = base quantity requested by each selling strategy
+            buy_quote   - ndarray = quote amount requested by each buying strategy
+            transact_ms - int     = transaction time used when there is no order
+    Output: A list                = [synthetic orders of the selling strategies;
+                                     synthetic orders of the buying strategies]
+    Note:   The crossed part is matched internally at the reference price, only the residual
+            carries the fill price of the order. The smaller side is filled in full at the
+            reference price, the larger side shares the crossed part plus the order fill pro
+            rata of what each strategy asked for. Without an order (residual below the
+            exchange minimum) every strategy is filled in full at the reference price.
+            Synthetic orders carry the fields read by log_order and log_execution.
+    """
+
+    sell_qty = np.asarray(sell_qty, dtype='float64')
+    buy_quote = np.asarray(buy_quote, dtype='float64')
+    total_sell, total_buy = sell_qty.sum(), buy_quote.sum()
+
+    exec_qty = float(order['executedQty']) if order else 0.0
+    exec_quote = float(order['cummulativeQuoteQty']) if order else 0.0
+
+    if order is None:
+        sells = sell_qty, sell_qty * price
+        buys = buy_quote / price, buy_quote
+    elif order['side'] == 'BUY':
+        sells = sell_qty, sell_qty * price
+        share = buy_quote / total_buy
+        buys = share * (total_sell + exec_qty), share * (total_sell * price + exec_quote)
+    else:
+        buys = buy_quote / price, buy_quote
+        share = sell_qty / total_sell
+        sells = share * (total_buy / price + exec_qty), share * (total_buy + exec_quote)
+
+    def synthetic(qty, quote):
+        return [{
+            'symbol': pair,
+            'orderId': order['orderId'] if order else None,
+            'transactTime': order['transactTime'] if order else transact_ms,
+            'submitTime': order.get('submitTime') if order else None,
+            'ackTime': order.get('ackTime') if order else None,
+            'executedQty': str(q),
+            'cummulativeQuoteQty': str(c),
+            'status': 'FILLED',
+            'netted': True
+        } for q, c in zip(qty, quote)]
+
+    return [synthetic(*sells), synthetic(*buys)]
+
+
+def ini_rollup_tbl(con, db, txn_tbl):
+    """
+    Info:   Create the PnL rollup tables and the equity curve, backfilled from txn_tbl when created
+    Path:   NA
+    Input:  con     - connection = SQLite connection
+            db      - string     = database name
+            txn_tbl - string     = transaction table name
+    Output: pnl_session, pnl_daily, pnl_strategy, pnl_pair and equity_curve tables
+    """
+
+    if con.execute("select count(*) from sqlite_master where type='table' and name='equity_curve'"
+                   ).fetchone()[0] == 1:
+        return
+
+    with con:
+        for tbl, key in rollup_tbl.items():
+            con.execute("""create table if not exists {0} (
+                               {1}           text primary key,
+                               orders        integer not null default 0,
+                               buys          integer not null default 0,
+                               sells         integer not null default 0,
+                               buy_quote     real not null default 0,
+                               sell_quote    real not null default 0,
+                               realized_pnl  real not null default 0,
+                               wins          integer not null default 0,
+                               losses        integer not null default 0)""".format(
+                tbl, key))
+        con.execute("""create table if not exists equity_curve (
+                           timestamp     text primary key,
+                           realized_pnl  real not null default 0,
+                           cum_pnl       real not null default 0,
+                           peak          real not null default 0,
+                           drawdown      real not null default 0)""")
+
+    if is_tbl_exist(txn_tbl, db):
+        rebuild_rollups(con, txn_tbl)
+
+
+def update_rollups(con, timestamp, pair, strategy, action, quote_qty, buy_quote=None):
+    """
+    Info:   Add one order to the PnL rollups and the equity curve, inside the caller's transaction
+    Path:   NA
+    Input:  con       - connection = SQLite connection used for the order journal write
+            timestamp - string     = batch timestamp
+            pair      - string     = pair name
+            strategy  - string     = strategy code
+            action    - string     = BUY/SELL/CUT_SELL
+            quote_qty - float      = quote amount of the order
+            buy_quote - float      = quote amount of the closed BUY, for SELL/CUT_SELL
+    Output: Updated rollup rows, realized PnL is in quote currency (USDT)
+    """
+
+    is_buy = action == 'BUY'
+    pnl = 0.0 if is_buy else quote_qty - buy_quote
+    values = (1, int(is_buy), int(not is_buy), quote_qty if is_buy else 0.0,
+              0.0 if is_buy else quote_qty, pnl, int(not is_buy and pnl > 0),
+              int(not is_buy and pnl <= 0))
+
+    keys = {
+        'pnl_session': timestamp,
+        'pnl_daily': timestamp[:10],
+        'pnl_strategy': strategy,
+        'pnl_pair': pair
+    }
+    for tbl, key in rollup_tbl.items():
+        con.execute(
+            """insert into {0} ({1}, orders, buys, sells, buy_quote, sell_quote, realized_pnl, wins, losses)
+               values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               on conflict ({1}) do update set
+                   orders = orders + excluded.orders,
+                   buys = buys + excluded.buys,
+                   sells = sells + excluded.sells,
+                   buy_quote = buy_quote + excluded.buy_quote,
+                   sell_quote = sell_quote + excluded.sell_quote,
+                   realized_pnl = realized_pnl + excluded.realized_pnl,
+                   wins = wins + excluded.wins,
+                   losses = losses + excluded.losses""".format(tbl, key),
+            (keys[tbl], ) + values)
+
+    # Running equity curve of realized PnL, one point per session
+    last = con.execute(
+        """select timestamp, cum_pnl, peak from equity_curve
+           order by timestamp desc limit 1""").fetchone()
+    if last is not None and last[0] == timestamp:
+        cum_pnl, peak = last[1] + pnl, max(last[2], last[1] + pnl)
+    else:
+        cum_pnl = (last[1] if last else 0.0) + pnl
+        peak = max(last[2] if last else 0.0, cum_pnl)
+    con.execute(
+        """insert into equity_curve (timestamp, realized_pnl, cum_pnl, peak, drawdown)
+           values (?, ?, ?, ?, ?)
+           on conflict (timestamp) do update set
+               realized_pnl = realized_pnl + excluded.realized_pnl,
+               cum_pnl = excluded.cum_pnl,
+               peak = excluded.peak,
+               drawdown = excluded.drawdown""",
+        (timestamp, pnl, cum_pnl, peak, cum_pnl - peak))
+
+
+def rebuild_rollups(con, txn_tbl):
+    """
+    Info:   Recompute the PnL rollups and the equity curve from the whole txn_tbl
+    Path:   NA
+    Input:  con     - connection = SQLite connection
+            txn_tbl - string     = transaction table name
+    Output: Rollup tables replayed from every journaled order
+    """
+
+    orders = con.execute(
+        """select timestamp, pair, strategy, action, quote_qty, pnl from {0}
+           order by timestamp, timestamp_txn""".format(txn_tbl)).fetchall()
+
+    with con:
+        for tbl in list(rollup_tbl) + ['equity_curve']:
+            con.execute('delete from {0}'.format(tbl))
+        for timestamp, pair, strategy, action, quote_qty, pnl in orders:
+            quote_qty = float(quote_qty)
+            buy_quote = None
+            if action != 'BUY':
+                # pnl is stored in percent of the BUY quote amount
+                buy_quote = quote_qty * 100 / (float(pnl or 0) + 100)
+            update_rollups(con, str(timestamp), pair, strategy, action,
+                           quote_qty, buy_quote)
+
+
+def get_pnl_summary(db, txn_time):
+    """
+    Info:   Get session, day and all-time PnL from the rollups
+    Path:   NA
+    Input:  db       - string   = database name
+            txn_time - datetime = session timestamp
+    Output: dataframe           = one row per horizon with orders, realized PnL, win rate and drawdown
+    """
+
+    con = lite.connect(db)
+    txn_time = str(pd.Timestamp(txn_time))
+
+    summary = pd.read_sql(
+        """select 'session' as horizon, orders, realized_pnl, wins, losses
+           from pnl_session where session=?
+           union all
+           select 'day', orders, realized_pnl, wins, losses
+           from pnl_daily where day=?
+           union all
+           select 'all', sum(orders), sum(realized_pnl), sum(wins), sum(losses)
+           from pnl_strategy""",
+        con,
+        params=(txn_time, txn_time[:10]))
+    drawdown = con.execute(
+        'select cum_pnl, drawdown from equity_curve order by timestamp desc limit 1'
+    ).fetchone()
+    con.close()
+
+    summary['win_rate'] = (summary['wins'] /
+                           (summary['wins'] + summary['losses'])).round(2)
+    summary['realized_pnl'] = summary['realized_pnl'].astype('float64').round(2)
+    summary['drawdown'] = round(drawdown[1], 2) if drawdown else 0.0
+
+    return summary[['horizon', 'orders', 'realized_pnl', 'win_rate', 'drawdown']]
+
+
+def ini_exec_tbl(con):
+    """
+    Info:   Create the execution ledger if it does not exist
+    Path:   NA
+    Input:  con - connection = SQLite connection
+    Output: exec_ledger = one row per strategy order: exchange clock timestamps (epoch ms) of
+                          the candle close, signal generation, submission, ack and fill,
+                          reference and fill price and slippage in basis points
+    """
+
+    con.execute("""create table if not exists {0} (
+                       timestamp     text not null,
+                       pair          text not null,
+                       strategy      text not null,
+                       action        text not null,
+                       order_id      integer,
+                       netted        integer not null default 0,
+                       close_ms      integer,
+                       signal_ms     integer,
+                       submit_ms     integer,
+                       ack_ms        integer,
+                       transact_ms   integer,
+                       ref_price     real,
+                       fill_price    real,
+                       qty           real,
+                       quote_qty     real,
+                       slippage_bps  real)""".format(exec_tbl))
+    con.execute('create index if not exists ix_{0}_timestamp on {0} (timestamp)'.format(exec_tbl))
+
+
+def log_execution(db, order, action, strategy, timestamp, ref_price=None, signal_ms=None,
+                  interval='8h'):
+    """
+    Info:   Record the timing and slippage of an order in the execution ledger
+    Path:   NA
+    Input:  db        - string   = database name
+            order     - dict     = order response (or net_fills share) with submitTime and ackTime
+            action    - string   = BUY/SELL/CUT_SELL
+            strategy  - string   = strategy code
+            timestamp - datetime = session timestamp, the open of the signal candle
+            ref_price - float    = close price the signal was generated on
+            signal_ms - int      = when the session signals were ready (exchange clock)
+            interval  - string   = kline interval, the candle closes one interval after timestamp
+    Output: Row in exec_ledger
+    Note:   Slippage is signed as a cost: positive when a BUY fills above or a SELL
+            below the reference price
+    """
+
+    qty = float(order['executedQty'])
+    quote_qty = float(order['cummulativeQuoteQty'])
+    fill_price = quote_qty / qty if qty > 0 else None
+    ref_price = None if ref_price is None or pd.isna(ref_price) else float(ref_price)
+
+    slippage = None
+    if fill_price is not None and ref_price:
+        slippage = (1 if action == 'BUY' else -1) * (fill_price - ref_price) / ref_price * 1e4
+
+    row = {
+        'timestamp': str(pd.Timestamp(timestamp)),
+        'pair': order['symbol'],
+        'strategy': strategy,
+        'action': action,
+        'order_id': order.get('orderId'),
+        'netted': int(order.get('netted', False)),
+        'close_ms': to_ms(timestamp) + interval_ms[interval],
+        'signal_ms': signal_ms,
+        'submit_ms': order.get('submitTime'),
+        'ack_ms': order.get('ackTime'),
+        'transact_ms': order.get('transactTime'),
+        'ref_price': ref_price,
+        'fill_price': fill_price,
+        'qty': qty,
+        'quote_qty': quote_qty,
+        'slippage_bps': slippage
+    }
+
+    con = lite.connect(db)
+    with con:
+        ini_exec_tbl(con)
+        con.execute(
+            'insert into {0} ({1}) values ({2})'.format(
+                exec_tbl, ', '.join(row), ', '.join('?' * len(row))),
+            list(row.values()))
+    con.close()
+
+
+def get_exec_summary(db, txn_time, percentiles=(50, 90, 99)):
+    """
+    Info:   Get latency and slippage percentiles of the orders of a session
+    Path:   NA
+    Input:  db          - string   = database name
+            txn_time    - datetime = session timestamp
+            percentiles - tuple    = percentiles reported
+    Output: dataframe              = one row per metric (exec_latency and slippage_bps)
+                                     with orders, the percentiles and max
+    """
+
+    con = lite.connect(db)
+    df = pd.read_sql('select * from {0} where timestamp=?'.format(exec_tbl), con,
+                     params=(str(pd.Timestamp(txn_time)), ))
+    con.close()
+
+    metrics = {k: df[end] - df[start] for k, (start, end) in exec_latency.items()}
+    metrics['slippage_bps'] = df['slippage_bps']
+
+    rows = []
+    for metric, values in metrics.items():
+        values = pd.to_numeric(values, errors='coerce').dropna()
+        if len(values) == 0:
+            continue
+        row = {'metric': metric, 'orders': len(values)}
+        for p in percentiles:
+            row['p{0}'.format(p)] = round(float(np.percentile(values, p)), 2)
+        row['max'] = round(float(values.max()), 2)
+        rows.append(row)
+
+    return pd.DataFrame(rows)
 
 
 def get_master_data(db, tbl):
@@ -639,49 +1526,120 @@ def get_master_data(db, tbl):
     return df
 
 
-def gen_ema_signal(db, master_tbl, start_date):
+def signal_task(pair, timestamp, close, strategies, use_cache=True):
+    """
+    Info:   Compute the simulated trades of every strategy of a pair (compute phase of gen_ema_signal)
+    Path:   NA
+    Input:  pair       - string  = pair name
+            timestamp  - ndarray = candle open times in epoch ms
+            close      - ndarray = close prices
+            strategies - list    = (ema, cut_loss) of the pair strategies
+            use_cache  - bool    = reuse EMAs through the indicator cache
+    Output: list                 = one list of (timestamp, sell_price, buy_price, pnl, action)
+                                   records per strategy, None if the strategy has no trade
+    Note:   Runs in the pool workers, no database access
+    """
+
+    df = pd.DataFrame({'timestamp': from_ms(timestamp), 'close': close})
+
+    out = []
+    for ema, cut_loss in strategies:
+        # Strategies of a pair sharing the same window and span reuse the EMA
+        ema_values = None
+        if len(df) != 0:
+            if use_cache:
+                ema_values = ind.cache.compute(pair, 'ema', (int(ema), ),
+                                               df.timestamp.iat[0], df.timestamp.iat[-1],
+                                               ind.ema, close)
+            else:
+                ema_values = ind.ema(close, int(ema))
+        result = simulate(df, ema, cut_loss, ema_values)
+        out.append(None if result[1] is None else
+                   list(result[1].itertuples(index=False, name=None)))
+
+    return out
+
+
+def _ini_signal_worker(cache_dir, max_files):
+    ind.cache.path = cache_dir
+    ind.cache.max_files = max_files
+
+
+def gen_ema_signal(db, master_tbl, start_date, pair_list=None, workers=1):
     """
     Info:   Generate signals according to master table
     Path:   NA
     Input:  db           - string  = database name
             master_tbl   - string  = master table name
             start_date   - string  = date to start generating signals (YYYYMMDD)
+            pair_list    - list    = only generate signals of these pairs, all pairs if None
+            workers      - int     = number of processes computing signals, in process if 1
     Output: Data in a SQLite table = signals list in signal_tbl of the input database
+    Note:   Prices are read once per pair and simulated in a process pool, one task per pair.
+            Signals are then written by this process alone in master_tbl order,
+            so the result is the same for any number of workers.
     """
 
     # Get master table data as dataframe
     df_master = get_master_data(db, master_tbl)
+    if pair_list is not None:
+        df_master = df_master.loc[df_master.pair.isin(pair_list)]
     signal_tbl = 'signal_tbl'
-    con = lite.connect(db)
 
-    for i, row in df_master.iterrows():
-        if  start_date is None\
-            or start_date == '':
-            start_date = dt.datetime.today() - dt.timedelta(
-                days=row['ema'] * 3)
+    if len(df_master) == 0:
+        return
+
+    if  start_date is None\
+        or start_date == '':
+        start_date = dt.datetime.today() - dt.timedelta(
+            days=int(df_master['ema'].iat[0]) * 3)
+
+    # Compute phase: one task per pair with its price arrays and strategies
+    groups = df_master.groupby('pair', sort=False)
+    tasks = []
+    for pair, rows in groups:
+        data = get_pair_data(pair, db, start_date=start_date, as_array=True)
+        tasks.append((pair, data['timestamp'], data['close'],
+                      list(zip(rows['ema'].tolist(), rows['cut_loss'].tolist()))))
+
+    if workers > 1 and len(tasks) > 1:
+        import multiprocessing as mp
+        with mp.get_context('spawn').Pool(min(workers, len(tasks)),
+                                          initializer=_ini_signal_worker,
+                                          initargs=(ind.cache.path, ind.cache.max_files)) as pool:
+            results = pool.starmap(signal_task, tasks, chunksize=1)
+    else:
+        results = [signal_task(*task) for task in tasks]
+
+    trades = {}
+    for (pair, rows), result in zip(groups, results):
+        trades.update(zip(rows.index, result))
 
-        df = get_pair_data(row['pair'], db)
-        df = df.loc[df.timestamp > '{0}'.format(start_date)]
-        result = simulate(df, row['ema'], row['cut_loss'])
+    # Persistence phase: single writer, master_tbl order
+    con = lite.connect(db)
 
-        if result[1] is not None:
+    for i, row in df_master.iterrows():
+        if trades[i] is not None:
             # Get strategy code
             strategy = str(row['ema']) + str(row['cut_loss'])
 
             # Get latest signal of the pair
-            latest_date = get_date(
-                db, 'signal_tbl',
-                """where pair='{0}' and strategy='{1}'""".format(
-                    row['pair'], strategy))
+            latest_date = get_watermark(db, row['pair'], strategy=strategy)
             if latest_date is False:
                 latest_date = start_date
 
             # Calculating statistic information
-            result[1]['pair'] = row['pair']
-            result[1]['strategy'] = strategy
+            result = pd.DataFrame(trades[i], columns=['timestamp', 'sell_price', 'buy_price',
+                                                      'pnl', 'action'])
+            result['pair'] = row['pair']
+            result['strategy'] = strategy
 
             # Update signal table with the most update data
-            result[1].loc[result[1].timestamp > '{0}'.format(latest_date)][[
-                'timestamp', 'pair', 'strategy', 'action', 'buy_price',
-                'sell_price'
-            ]].to_sql(signal_tbl, con, if_exists='append', index=False)
+            new_signal = result.loc[
+                result.timestamp > '{0}'.format(latest_date)][[
+                    'timestamp', 'pair', 'strategy', 'action', 'buy_price',
+                    'sell_price'
+                ]]
+            write_signals(con, db, signal_tbl, new_signal)
+
+    con.close()
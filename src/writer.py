@@ -0,0 +1,130 @@
+###########################################################################################################################################
+# KLINE WRITER
+###########################################################################################################################################
+
+import os
+import queue
+import sqlite3 as lite
+import threading
+from collections import Counter
+
+import utils as lib
+
+
+class KlineWriter:
+    """
+    Info:   Single SQLite writer of kline batches, run by a background thread
+    Path:   NA
+    Note:   put() blocks while the queue is full, so fetchers slow down to the pace of the
+            disk instead of piling pages up in memory. The writer thread owns the only
+            connection, takes every batch waiting on the queue (up to batch_size) and
+            commits them in one transaction, with the watermark of every pair.
+            A batch that fails is retried pair by pair so one bad pair only loses its own rows.
+            Any other failure is logged and the thread keeps going until close(), and put()
+            raises instead of waiting forever if the thread is gone anyway.
+    """
+
+    def __init__(self, db, interval='8h', queue_size=16, batch_size=8,
+                 log_file='log_master_code.log'):
+        """
+        Input:  db         - string = database name
+                interval   - string = kline interval of the batches
+                queue_size - int    = batches waiting in memory before put() blocks
+                batch_size - int    = max batches committed per transaction
+                log_file   - string = log file name
+        """
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.log_file = log_file
+        self.written = Counter()
+        self.failed = []
+        self.commits = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run,
+                                        name='writer-' + os.path.basename(db),
+                                        daemon=True)
+        self._thread.start()
+
+    def put(self, pair, rows, poll=1.0):
+        """
+        Info:   Queue the closed candles of a pair, waits while the queue is full
+        Input:  pair - string = pair name
+                rows - list   = tuples in kline_schema order or a typed kline DataFrame
+                poll - float  = seconds between checks that the writer thread is alive
+        Note:   From a coroutine: await loop.run_in_executor(None, writer.put, pair, rows)
+        """
+        while True:
+            if not self._thread.is_alive():
+                raise RuntimeError(f'Writer {self.db} stopped, {pair} not written')
+            try:
+                self._queue.put((pair, rows), timeout=poll)
+                return
+            except queue.Full:
+                pass
+
+    def _reload(self, con):
+        # Watermarks moved by a rolled back transaction
+        try:
+            lib.load_watermarks(self.db, reload=True, con=con)
+        except Exception as e:
+            lib.log(self.log_file, f'Writer watermarks - {e}', stage='get_data')
+
+    def _write(self, con, batch):
+        try:
+            for pair, rows in batch:
+                lib.ini_kline_tbl(con, pair)
+            with con:
+                counts = [(pair, lib.upsert_klines(con, self.db, pair, rows, self.interval))
+                          for pair, rows in batch]
+            self.commits += 1
+        except Exception:
+            self._reload(con)
+            counts = []
+            for pair, rows in batch:
+                try:
+                    lib.ini_kline_tbl(con, pair)
+                    counts.append((pair, lib.write_klines(con, self.db, pair, rows, self.interval)))
+                    self.commits += 1
+                except Exception as e:
+                    self._reload(con)
+                    self.failed.append(pair)
+                    lib.log(self.log_file, f'Writer {pair} - {e}', pair=pair, stage='get_data')
+
+        for pair, n in counts:
+            self.written[pair] += n
+
+    def _run(self):
+        con = lite.connect(self.db)
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = [b for b in batch if b is not None]
+            if batch:
+                try:
+                    self._write(con, batch)
+                except Exception as e:
+                    self.failed += [pair for pair, rows in batch]
+                    lib.log(self.log_file, f'Writer - {e}', stage='get_data')
+        con.close()
+
+    def close(self):
+        """
+        Info:   Write every queued batch and stop the thread
+        Output: Counter = new candles written per pair
+        """
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=1.0)
+                self._thread.join()
+            except queue.Full:
+                pass
+        return self.written